@@ -13,7 +13,7 @@ from services.llm import llm_service
 from services.cache import cache_service
 from evaluation.ragas_eval import ragas_evaluator
 import structlog
-import json
+import orjson
 import os
 import time
 import asyncio
@@ -24,6 +24,11 @@ router = APIRouter()
 VALID_CHAT_MODES = {"fast", "quality", "direct"}
 CHAT_HISTORY_LIMIT = 8
 
+def _sse(payload: dict) -> str:
+    """Format one Server-Sent Events data frame"""
+    data = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return f"data: {data.decode()}\n\n"
+
 def _normalize_mode(mode: str | None) -> str:
     if not mode:
         return "quality"
@@ -92,7 +97,12 @@ async def _run_direct_mode(query: str, chat_history: list[dict] | None = None) -
     prompt_parts.append(f"User Question: {query}")
     prompt_parts.append("Answer directly. Reference the conversation when it helps.")
     prompt = "\n\n".join(prompt_parts)
-    answer = await llm_service.generate(prompt, system_prompt=system_prompt)
+    # With history the answer depends on more than the question, so only history-free prompts are fuzzy-matched
+    answer = await llm_service.generate(
+        prompt,
+        system_prompt=system_prompt,
+        semantic_key=None if history_prompt else query
+    )
     response_time_ms = (time.time() - start_time) * 1000
     return {
         "answer": answer.strip(),
@@ -226,7 +236,7 @@ async def query_stream(request: QueryRequest):
             succeeded = False
             
             # Inform client about conversation context
-            yield f"data: {json.dumps({'type': 'conversation', 'content': {'conversation_id': conversation_id}})}\n\n"
+            yield _sse({'type': 'conversation', 'content': {'conversation_id': conversation_id}})
             
             try:
                 if mode == "direct":
@@ -244,7 +254,7 @@ async def query_stream(request: QueryRequest):
                     
                     async for chunk in llm_service.generate_stream(direct_prompt, system_prompt=system_prompt):
                         assistant_answer += chunk
-                        yield f"data: {json.dumps({'type': 'answer_chunk', 'content': chunk, 'done': False})}\n\n"
+                        yield _sse({'type': 'answer_chunk', 'content': chunk, 'done': False})
                     
                     response_time_ms = (time.time() - start_time) * 1000
                     metadata_block.update({
@@ -254,7 +264,7 @@ async def query_stream(request: QueryRequest):
                         "was_corrected": False,
                         "correction_attempts": 0
                     })
-                    yield f"data: {json.dumps({'type': 'metadata', 'content': metadata_block, 'done': True})}\n\n"
+                    yield _sse({'type': 'metadata', 'content': metadata_block, 'done': True})
                     succeeded = True
                 
                 elif mode == "fast":
@@ -273,7 +283,7 @@ async def query_stream(request: QueryRequest):
                             metadata_block.update(chunk.get("content", {}))
                             chunk["content"] = metadata_block
                         
-                        yield f"data: {json.dumps(chunk)}\n\n"
+                        yield _sse(chunk)
                     
                     if "response_time_ms" not in metadata_block:
                         metadata_block["response_time_ms"] = (time.time() - start_time) * 1000
@@ -302,7 +312,7 @@ async def query_stream(request: QueryRequest):
                             metadata_block.update(chunk.get("content", {}))
                             chunk["content"] = metadata_block
                         
-                        yield f"data: {json.dumps(chunk)}\n\n"
+                        yield _sse(chunk)
                     
                     if "response_time_ms" not in metadata_block:
                         metadata_block["response_time_ms"] = (time.time() - start_time) * 1000
@@ -328,7 +338,7 @@ async def query_stream(request: QueryRequest):
                     mode=mode
                 )
                 
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+                yield _sse({'type': 'error', 'content': str(e)})
                 return
             
             if succeeded:
@@ -381,19 +391,16 @@ async def upload_document(file: UploadFile = File(...)):
         with open(file_path, "wb") as f:
             f.write(contents)
         
-        # Index document
+        # Index document (its chunks are appended to the BM25 index as well)
         result = vector_store.index_document(file_path)
         
-        # CRITICAL: Rebuild BM25 for hybrid search
-        vector_store._rebuild_bm25_index()
-        logger.info("bm25_rebuilt_after_upload")
-        
         # CRITICAL: Clear cache so new documents are immediately searchable
         cache_service.clear()
         logger.info("cache_cleared_after_upload")
         
         verify_count = len(vector_store.collection.get(
-            where={"source": file.filename}
+            where={"source": file.filename},
+            include=[]
         )['ids'])
         
         logger.info("upload_complete", 
@@ -422,7 +429,7 @@ async def initialize_database():
     try:
         logger.info("initialize_request")
         
-        vector_store.load_pdfs()
+        await vector_store.load_pdfs()
         
         logger.info("initialize_complete")
         
@@ -514,9 +521,10 @@ async def get_documents():
         
         documents = []
         for filename in files:
-            # Get chunk count from vector store
+            # Get chunk count from vector store (ids only, no embeddings or documents)
             results = vector_store.collection.get(
-                where={"source": filename}
+                where={"source": filename},
+                include=[]
             )
             chunk_count = len(results['ids']) if results else 0
             
@@ -545,7 +553,7 @@ async def delete_document(filename: str):
         
         logger.info("delete_document_start", filename=filename)
                 
-        results = vector_store.collection.get(where={"source": filename})
+        results = vector_store.collection.get(where={"source": filename}, include=[])
         
         if results and results['ids']:
             vector_store.collection.delete(ids=results['ids'])
@@ -567,7 +575,7 @@ async def delete_document(filename: str):
             logger.info("file_deleted", filename=filename)
         
         #  Verify deletion
-        verify_results = vector_store.collection.get(where={"source": filename})
+        verify_results = vector_store.collection.get(where={"source": filename}, include=[])
         remaining = len(verify_results['ids']) if verify_results else 0
         
         if remaining > 0:
@@ -625,17 +633,8 @@ async def get_feedback_stats():
 async def reset_feedback():
     """Reset all feedback data"""
     try:
-        import os
-        feedback_db_path = "/app/feedback.db"
-        
-        if os.path.exists(feedback_db_path):
-            os.remove(feedback_db_path)
-            logger.info("feedback_db_deleted")
-        
-        # Reinitialize
-        from services.feedback import FeedbackService
-        global feedback_service
-        feedback_service = FeedbackService()
+        # Deleting the DB file would leave a stale -wal/-shm pair behind in WAL mode
+        feedback_service.reset()
         
         return {"message": "Feedback reset successfully"}
     except Exception as e:
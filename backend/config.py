@@ -5,20 +5,35 @@ class Settings(BaseSettings):
     # Ollama Config
     OLLAMA_HOST: str = "http://ollama:11434"
     OLLAMA_MODEL: str = "phi3:mini"
+    OLLAMA_MAX_KEEPALIVE: int = 32  # Idle keep-alive sockets held by the pooled client
+    OLLAMA_MAX_CONNECTIONS: int = 64
+    STREAM_FLUSH_CHARS: int = 1024  # Streamed tokens are coalesced up to this many chars...
+    STREAM_FLUSH_INTERVAL: float = 0.05  # ...or this many seconds since the last yield
+    LLM_HEDGE_DELAY: float = 0.0  # Seconds before a duplicate generate request races a slow one (0 = off)
     
     # Database Config
     CHROMA_DB_PATH: str = "/app/chroma_db"
     METRICS_DB_PATH: str = "/app/metrics.db"
     CHAT_HISTORY_DB_PATH: str = "/app/chat_history.db"
+    EMBEDDING_CACHE_DB_PATH: str = "/app/embedding_cache.db"  # Chunk embeddings reused across re-indexing
     
     # Redis Config
     REDIS_HOST: str = "redis"
     REDIS_PORT: int = 6379
     REDIS_TTL: int = 3600  # 1 hour cache
     
+    # Semantic LLM response cache (paraphrased prompts reuse a cached answer)
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # Cosine similarity required for a hit
+    SEMANTIC_CACHE_TTL: int = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 2048  # Per partition (model + system prompt + prompt template)
+    
     # Model Config
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
     RERANKER_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    EMBEDDING_INT8: bool = False  # Dynamic int8 quantization of the embedding model on CPU (re-index after toggling)
+    RERANKER_INT8: bool = False  # Dynamic int8 quantization of the cross-encoder on CPU
+    RERANK_BATCH_SIZE: int = 64
     
     # RAG Parameters - OPTIMIZED FOR QUALITY
     CHUNK_SIZE: int = 1024  
@@ -27,6 +42,17 @@ class Settings(BaseSettings):
     TOP_K_RERANK: int = 7
     TOP_K_BM25: int = 10
     RERANK_THRESHOLD: float = -5.0  # Stricter threshold -2.0 to -5.00
+    RETRIEVAL_CONCURRENCY: int = 4  # Max hybrid searches / reranks running in worker threads
+    
+    # Ingestion
+    PDF_EXTRACT_WORKERS: int = 4  # Processes for PDF text extraction, capped at the CPU count (1 = in-process)
+    EMBED_BATCH: int = 256  # Chunks embedded and added to Chroma per call during indexing
+    
+    # Answer validation - lexical pre-check before the LLM fact-check
+    VALIDATION_MIN_ANSWER_TOKENS: int = 8  # Shorter answers always go to the LLM
+    VALIDATION_GROUNDED_THRESHOLD: float = 0.85  # Answer 3-grams found in context => correct
+    VALIDATION_UNGROUNDED_THRESHOLD: float = 0.2  # Answer words found in context => incorrect
+    VALIDATION_CONTEXT_TOKENS: int = 512  # Context sent to the LLM fact-check, in tokenizer tokens
     
     # Agent Parameters - MODE BASED
     FAST_MODE: bool = os.getenv("FAST_MODE", "false").lower() == "true"
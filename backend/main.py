@@ -2,6 +2,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
 from config import settings
+from services.llm import llm_service
+from services.metrics import metrics_tracker
+from services.pdf_extraction import shutdown_executor
 import structlog
 import logging
 
@@ -42,10 +45,14 @@ async def startup_event():
                 status="starting",
                 ollama_host=settings.OLLAMA_HOST,
                 model=settings.OLLAMA_MODEL)
+    metrics_tracker.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("shutdown", status="stopping")
+    await metrics_tracker.stop()
+    await llm_service.aclose()
+    shutdown_executor()
 
 @app.get("/")
 def read_root():
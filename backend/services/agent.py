@@ -1,15 +1,73 @@
+import asyncio
+import re
 import time
 import structlog
 from typing import List, Dict, Any, AsyncGenerator
 from langgraph.graph import StateGraph, END
 from services.llm import llm_service
 from services.vector_store import vector_store
+from services.embedding import embedding_service
 from services.reranker import reranker_service
 from services.cache import cache_service
 from config import settings
 
 logger = structlog.get_logger()
 
+NO_ANSWER_MESSAGE = "I cannot find this information in the provided documents."
+NO_ANSWER_MARKER = "cannot find"
+# Only an answer that opens with this is a refusal ("The authors cannot find..." is an answer)
+NO_ANSWER_LEAD = "i cannot find"
+
+def _leading_refusal(text: str) -> bool | None:
+    """Whether the answer opens with a refusal, or None while too little has streamed to tell"""
+    opening = text.lstrip(" \t\n\"'*").lower()
+    if len(opening) < len(NO_ANSWER_LEAD):
+        return None
+    return opening.startswith(NO_ANSWER_LEAD)
+
+# Kept byte-identical across every generation call so backends with prefix
+# caching (Ollama/llama.cpp, vLLM) can reuse the KV cache of the system prompt
+# and the static prompt header; all per-request content goes after them.
+SYSTEM_PROMPT_STRICT_QA = f"""You are a precise document assistant. Your ONLY job is to answer questions based on the provided context.
+
+STRICT RULES:
+1. If the answer is NOT in the context, you MUST respond: "{NO_ANSWER_MESSAGE}"
+2. NEVER use your general knowledge or training data.
+3. NEVER make assumptions or inferences beyond what's explicitly stated.
+4. If unsure, say you cannot find the information.
+5. ALWAYS follow user's formatting instructions (e.g., "in 1 sentence", "as a list", etc.)"""
+
+# Sentence end in a streamed answer: whitespace after skips decimals like "3.5",
+# and a capital or digit next skips most abbreviations ("e.g. the")
+SENTENCE_END_RE = re.compile(r"[.!?]\s+(?=[A-Z0-9])|\n")
+
+def _opening_sentence(answer: str) -> str | None:
+    """
+    The answer's first sentence, once complete and long enough to be judged on its own
+
+    None while it is still streaming, and for answers whose first line isn't a
+    full sentence ("1.", "The steps are:", headings): those are only checked whole.
+    """
+    opening = answer.lstrip()
+    for match in SENTENCE_END_RE.finditer(opening):
+        if opening[match.start()] == "\n":
+            return None
+        sentence = opening[:match.start() + 1]
+        if len(sentence.split()) >= settings.VALIDATION_MIN_ANSWER_TOKENS:
+            return sentence
+    return None
+
+# Static instructions lead the prompt so Ollama can reuse the cached prefix across queries
+QUERY_REWRITE_INSTRUCTIONS = """Rewrite the query below into different variations to improve document retrieval.
+Each variation should capture different aspects or phrasings of the question.
+Write one variation per line, without numbering or bullets."""
+
+GENERATION_CONTEXT_HEADER = "Context from documents:\n"
+GENERATION_ANSWER_INSTRUCTION = (
+    "Answer based ONLY on the context above. Follow the strict rules AND "
+    "respect any formatting requests in the user's question:"
+)
+
 class AgentState(Dict):
     """State for RAG agent"""
     pass
@@ -19,6 +77,9 @@ class RAGAgent:
     
     def __init__(self):
         self.graph = self._build_graph()
+        # Search and rerank are synchronous; they run in worker threads, bounded
+        # so concurrent requests don't oversubscribe the index and models
+        self._retrieval_semaphore = asyncio.Semaphore(settings.RETRIEVAL_CONCURRENCY)
         logger.info("rag_agent_init", status="ready")
     
     def _build_graph(self):
@@ -64,14 +125,13 @@ class RAGAgent:
             logger.info("query_rewrite_skipped", reason="single_variation")
             return state
         
-        prompt = f"""Rewrite this query into {desired_variations} different variations to improve document retrieval.
-Each variation should capture different aspects or phrasings of the question.
-
-Original Query: {state['query']}
-
-Provide {desired_variations} variations, one per line, without numbering or bullets:"""
+        prompt = (
+            f"{QUERY_REWRITE_INSTRUCTIONS}\n\n"
+            f"Original Query: {state['query']}\n\n"
+            f"Provide {desired_variations} variations:"
+        )
         
-        response = await llm_service.generate(prompt)
+        response = await llm_service.generate(prompt, semantic_key=state['query'])
         queries = [q.strip() for q in response.split('\n') if q.strip()]
         queries = queries[:desired_variations]
         
@@ -89,36 +149,56 @@ Provide {desired_variations} variations, one per line, without numbering or bull
         """Retrieve documents using hybrid search with parallel queries"""
         logger.info("agent_step", step="retrieve")
         
-        # Check cache first
+        # Per-request caches: correction attempts re-run the same variations
+        embed_cache = state.setdefault("embed_cache", {})
+        retrieval_cache = state.setdefault("retrieval_cache", {})
+
+        async def retrieve_single(query):
+            cached = retrieval_cache.get(query)
+            if cached is not None:
+                return cached
+            # Embedded outside the semaphore so concurrent variations share one encode batch
+            embedding = embed_cache.get(query)
+            if embedding is None:
+                embedding = await embedding_service.embed_query_async(query)
+                embed_cache[query] = embedding
+            async with self._retrieval_semaphore:
+                result = await asyncio.to_thread(
+                    vector_store.hybrid_search,
+                    query,
+                    top_k=settings.TOP_K_RETRIEVAL,
+                    query_embedding=embedding
+                )
+            retrieval_cache[query] = result
+            return result
+
+        async def retrieve_all() -> List[str]:
+            # Parallel retrieval for each query variation
+            results = await asyncio.gather(*[retrieve_single(q) for q in state["rewritten_queries"]])
+
+            # Deduplicate by chunk id and sum fused scores across variations,
+            # so documents matched by several variations rank first
+            fused: Dict[str, list] = {}
+            for result in results:
+                for doc_id, doc, score in zip(result["ids"], result["documents"], result["scores"]):
+                    entry = fused.get(doc_id)
+                    if entry is None:
+                        fused[doc_id] = [doc, score]
+                    else:
+                        entry[1] += score
+
+            ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+            return [doc for doc, _ in ranked[:settings.TOP_K_RETRIEVAL]]
+
+        # Cache lookup; on a miss the results are cached in the background
         cache_key = cache_service._generate_key("retrieval", state['query'])
-        cached_docs = cache_service.get(cache_key)
+        unique_docs, cache_hit = await cache_service.get_or_set(cache_key, retrieve_all)
+        state["retrieved_docs"] = unique_docs
+        state["cache_hit"] = cache_hit
         
-        if cached_docs:
-            state["retrieved_docs"] = cached_docs
-            state["cache_hit"] = True
+        if cache_hit:
             logger.info("retrieval_cache_hit")
             return state
-        state["cache_hit"] = False
-        all_docs = set()
-        
-        # Parallel retrieval for each query variation
-        import asyncio
-        
-        async def retrieve_single(query):
-            return vector_store.hybrid_search(query, top_k=settings.TOP_K_RETRIEVAL)
-        
-        # Run all queries in parallel
-        results = await asyncio.gather(*[retrieve_single(q) for q in state["rewritten_queries"]])
-        
-        for result in results:
-            all_docs.update(result["documents"])
-        
-        # Convert to list and limit
-        unique_docs = list(all_docs)[:settings.TOP_K_RETRIEVAL]
-        state["retrieved_docs"] = unique_docs
-        
-        # Cache the results
-        cache_service.set(cache_key, unique_docs)
         
         logger.info("retrieval_complete", 
                    num_docs=len(unique_docs),
@@ -137,12 +217,14 @@ Provide {desired_variations} variations, one per line, without numbering or bull
             return state
         
         # Re-rank using cross-encoder
-        ranked = reranker_service.rerank(
-            state["query"],
-            state["retrieved_docs"],
-            top_k=settings.TOP_K_RERANK,
-            threshold=-5.0
-        )
+        async with self._retrieval_semaphore:
+            ranked = await asyncio.to_thread(
+                reranker_service.rerank,
+                state["query"],
+                state["retrieved_docs"],
+                top_k=settings.TOP_K_RERANK,
+                threshold=-5.0
+            )
         
         state["ranked_docs"] = [doc for doc, score in ranked]
         state["retrieval_score"] = float(ranked[0][1]) if ranked else 0.0
@@ -157,50 +239,33 @@ Provide {desired_variations} variations, one per line, without numbering or bull
         """Generate answer from retrieved context"""
         logger.info("agent_step", step="generate")
         
-        history_context = self._format_history_context(state.get("chat_history"))
-        if not state["ranked_docs"] and not history_context:
+        prompts = self._build_generation_prompt(state)
+        if prompts is None:
             state["answer"] = "I couldn't find relevant information to answer your question."
             return state
+        system_prompt, prompt = prompts
         
-        context_sections = []
-        if history_context:
-            context_sections.append(history_context)
-        if state["ranked_docs"]:
-            context_sections.append("Document excerpts:\n" + "\n\n".join(state["ranked_docs"]))
-        context = "\n".join(context_sections)
-
-        system_prompt = """You are a STRICT document Q&A system. You MUST follow these rules:
-
-        CRITICAL RULES:
-        1. ONLY use information from the Context below
-        2. If answer is NOT in Context, respond EXACTLY: "I cannot find this information in the provided documents."
-        3. NEVER add information from your training data
-        4. NEVER make assumptions or inferences
-        5. NEVER say "based on my knowledge" or similar phrases
-        6. If unsure, say you cannot find the information
-
-        
-
-        """
-
-        prompt = f"""Context from documents:
-        {context}
-
-        User Question: {state['query']}
-
-        Remember: Answer ONLY from the context above. If you cannot find the answer, say "I cannot find this information in the provided documents."
-
-        Answer:"""
-
-             
-        prompt = f"""Context from documents:
-{context}
-
-User Question: {state['query']}
-
-Answer based ONLY on the context above. Follow the strict rules AND respect any formatting requests in the user's question:"""
-        
-        answer = await llm_service.generate(prompt, system_prompt=system_prompt)
+        # Stream so a refusal can be detected from its first tokens instead of
+        # waiting for the full generation
+        parts: List[str] = []
+        prefix_checked = False
+        stream = llm_service.generate_stream(prompt, system_prompt=system_prompt)
+        try:
+            async for chunk in stream:
+                parts.append(chunk)
+                if not prefix_checked:
+                    refusal = _leading_refusal("".join(parts))
+                    if refusal is None:
+                        continue
+                    prefix_checked = True
+                    if refusal:
+                        logger.info("generation_early_exit", reason="cannot_find")
+                        parts = [NO_ANSWER_MESSAGE]
+                        break
+        finally:
+            await stream.aclose()
+        
+        answer = "".join(parts)
         state["answer"] = answer.strip()
         
         logger.info("generation_complete", answer_length=len(answer))
@@ -224,28 +289,38 @@ Answer based ONLY on the context above. Follow the strict rules AND respect any
                    attempt=state.get("correction_attempts", 0))
         return "correct_again"
     
-    def _format_history_context(self, history: List[Dict[str, Any]] | None) -> str:
-        if not history:
-            return ""
-        trimmed = history[-10:]
-        segments = []
-        for item in trimmed:
-            role = "User" if item.get("role") == "user" else "Assistant"
-            content = item.get("content", "").strip()
-            if content:
-                segments.append(f"{role}: {content}")
-        if not segments:
-            return ""
-        return "Conversation history:\n" + "\n".join(segments) + "\n\n"
+    def _build_generation_prompt(self, state: AgentState) -> tuple[str, str] | None:
+        """Build (system_prompt, prompt) for answer generation, or None if there is nothing to answer from"""
+        context = self._build_context(state.get("chat_history"), state["ranked_docs"])
+        if not context:
+            return None
+        
+        prompt = (
+            f"{GENERATION_CONTEXT_HEADER}{context}\n\n"
+            f"User Question: {state['query']}\n\n"
+            f"{GENERATION_ANSWER_INSTRUCTION}"
+        )
+        
+        return SYSTEM_PROMPT_STRICT_QA, prompt
     
-    def _combine_context(self, ranked_docs: List[str], history: List[Dict[str, Any]] | None) -> str:
-        parts: List[str] = []
-        history_context = self._format_history_context(history)
-        if history_context:
-            parts.append(history_context.strip())
+    def _build_context(self, history: List[Dict[str, Any]] | None, ranked_docs: List[str]) -> str:
+        """Render recent history and document excerpts into one context string in a single pass"""
+        buf: List[str] = []
+        for item in (history or [])[-10:]:
+            content = (item.get("content") or "").strip()
+            if not content:
+                continue
+            buf.append("\n" if buf else "Conversation history:\n")
+            buf.append("User: " if item.get("role") == "user" else "Assistant: ")
+            buf.append(content)
+        
         if ranked_docs:
-            parts.append("Document excerpts:\n" + "\n\n".join(ranked_docs))
-        return "\n\n".join(parts).strip()
+            if buf:
+                buf.append("\n\n")
+            buf.append("Document excerpts:\n")
+            buf.append("\n\n".join(ranked_docs))
+        
+        return "".join(buf)
     
     async def run(self, 
                   query: str, 
@@ -270,7 +345,9 @@ Answer based ONLY on the context above. Follow the strict rules AND respect any
             "chat_history": chat_history or [],
             "max_corrections": max_corrections if max_corrections is not None else settings.MAX_CORRECTION_ATTEMPTS,
             "num_query_variations": num_query_variations if num_query_variations is not None else settings.NUM_QUERY_VARIATIONS,
-            "cache_hit": False
+            "cache_hit": False,
+            "embed_cache": {},
+            "retrieval_cache": {}
             
         }
         
@@ -324,7 +401,9 @@ Answer based ONLY on the context above. Follow the strict rules AND respect any
             "metadata": {},
             "chat_history": chat_history or [],
             "max_corrections": 0,  # NO SELF-CORRECTION IN FAST MODE
-            "num_query_variations": 1  # SINGLE QUERY ONLY
+            "num_query_variations": 1,  # SINGLE QUERY ONLY
+            "embed_cache": {},
+            "retrieval_cache": {}
         }
         
         logger.info("agent_run_start", query=query, mode="fast")
@@ -388,7 +467,9 @@ Answer based ONLY on the context above. Follow the strict rules AND respect any
             "metadata": {},
             "chat_history": chat_history or [],
             "max_corrections": max_corrections,
-            "num_query_variations": actual_variations
+            "num_query_variations": actual_variations,
+            "embed_cache": {},
+            "retrieval_cache": {}
         }
         
         # Step 1: Rewrite query
@@ -405,39 +486,24 @@ Answer based ONLY on the context above. Follow the strict rules AND respect any
         
         # Step 4: Generate answer with streaming
         yield {"type": "status", "content": "Generating answer...", "done": False}
+        speculative = None
         
-        history_context = self._format_history_context(state.get("chat_history"))
-        if not state["ranked_docs"] and not history_context:
+        prompts = self._build_generation_prompt(state)
+        if prompts is None:
             answer = "I couldn't find relevant information to answer your question."
             yield {"type": "answer", "content": answer, "done": True}
         else:
-            context_sections = []
-            if history_context:
-                context_sections.append(history_context)
-            if state["ranked_docs"]:
-                context_sections.append("Document excerpts:\n" + "\n\n".join(state["ranked_docs"]))
-            context = "\n".join(context_sections)
-            
-            system_prompt = """You are a precise document assistant. Your ONLY job is to answer questions based on the provided context.
-
-STRICT RULES:
-1. If the answer is NOT in the context, you MUST respond: "I cannot find this information in the provided documents."
-2. NEVER use your general knowledge or training data.
-3. NEVER make assumptions or inferences beyond what's explicitly stated.
-4. If unsure, say you cannot find the information.
-5. ALWAYS follow user's formatting instructions (e.g., "in 1 sentence", "as a list", etc.)"""
+            system_prompt, prompt = prompts
             
-            prompt = f"""Context from documents:
-{context}
-
-User Question: {state['query']}
-
-Answer based ONLY on the context above:"""
+            # Quality check can only run against documents; decide that up front
+            can_speculate = not is_fast_mode and bool(state["ranked_docs"])
             
             # Stream the answer
             full_answer = ""
             async for chunk in llm_service.generate_stream(prompt, system_prompt=system_prompt):
                 full_answer += chunk
+                if can_speculate and speculative is None:
+                    speculative = self._start_speculative_validation(state, full_answer)
                 yield {"type": "answer_chunk", "content": chunk, "done": False}
             
             yield {"type": "answer", "content": full_answer, "done": True}
@@ -446,7 +512,7 @@ Answer based ONLY on the context above:"""
         # Step 5: Validate (only if not fast mode)
         if not is_fast_mode:
             yield {"type": "status", "content": "Validating answer...", "done": False}
-            state = await self._validate(state)
+            state = await self._validate(state, speculative=speculative)
             
             # If validation failed and we can correct, loop
             while not state.get("is_correct", True) and state.get("correction_attempts", 0) < max_corrections:
@@ -483,7 +549,40 @@ Answer based ONLY on the context above:"""
             },
             "done": True
         }
-    async def _validate(self, state: AgentState) -> AgentState:
+    def _start_speculative_validation(self, state: AgentState, partial_answer: str) -> tuple | None:
+        """Start the LLM quality check on the first streamed sentence, returning (checked_text, task)"""
+        if NO_ANSWER_MARKER in partial_answer.lower():
+            return None
+        checked = _opening_sentence(partial_answer)
+        if checked is None:
+            return None
+        
+        task = asyncio.create_task(llm_service.check_answer_quality(
+            state["query"],
+            checked,
+            "\n\n".join(state["ranked_docs"])
+        ))
+        logger.info("speculative_validation_started", checked_length=len(checked))
+        return checked, task
+    
+    async def _speculative_verdict(self, state: AgentState, speculative: tuple) -> dict | None:
+        """Reuse a speculative check if it covers the whole answer or already failed"""
+        checked, task = speculative
+        try:
+            verdict = await task
+        except Exception as e:
+            logger.warning("speculative_validation_error", error=str(e))
+            return None
+        
+        # An unsupported first sentence fails the whole answer (_opening_sentence only
+        # hands over complete, non-trivial ones); a pass only counts if nothing was
+        # generated after the checked text
+        if checked == state["answer"].strip() or not verdict.get("is_correct", False):
+            logger.info("speculative_validation_used", is_correct=verdict.get("is_correct", False))
+            return verdict
+        return None
+    
+    async def _validate(self, state: AgentState, speculative: tuple | None = None) -> AgentState:
         """Validate answer quality"""
         logger.info("agent_step", step="validate")
         
@@ -504,6 +603,8 @@ Answer based ONLY on the context above:"""
         
         # Answer already says "cannot find" → correct
         if "cannot find" in state["answer"].lower():
+            if speculative is not None:
+                speculative[1].cancel()
             state["is_correct"] = True
             state["correction_reason"] = "Correctly stated no information"
             logger.info("validation_passed", reason="cannot_find")
@@ -513,11 +614,15 @@ Answer based ONLY on the context above:"""
         context = "\n\n".join(state["ranked_docs"])
         
         try:
-            validation = await llm_service.check_answer_quality(
-                state["query"],
-                state["answer"],
-                context
-            )
+            validation = None
+            if speculative is not None:
+                validation = await self._speculative_verdict(state, speculative)
+            if validation is None:
+                validation = await llm_service.check_answer_quality(
+                    state["query"],
+                    state["answer"],
+                    context
+                )
             
             state["is_correct"] = validation.get("is_correct", False)
             state["correction_reason"] = validation.get("reason", "")
@@ -1,68 +1,327 @@
-from rank_bm25 import BM25Okapi
+from collections import Counter
+from functools import lru_cache
+from scipy.sparse import csr_matrix, vstack
 from config import settings
+import numpy as np
+import orjson
+import os
+import re
 import structlog
+import uuid
 from typing import List, Tuple
 
 logger = structlog.get_logger()
 
+# Bump when the tokenizer or the saved layout changes; older saved indexes are then rebuilt
+STATE_VERSION = 2
+STATE_ARRAYS_FILE = "bm25.npz"
+STATE_META_FILE = "bm25.json"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; punctuation is dropped instead of glued to words"""
+    return _TOKEN_RE.findall(text.lower())
+
+@lru_cache(maxsize=4096)
+def _tokenize_query(query: str) -> Tuple[str, ...]:
+    """Tokenize a query (memoized, queries repeat across variations and corrections)"""
+    return tuple(tokenize(query))
+
 class BM25SearchService:
     """BM25 keyword-based search service"""
-    
-    def __init__(self):
-        self.corpus = []
-        self.tokenized_corpus = []
-        self.bm25 = None
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        # Same defaults as rank_bm25.BM25Okapi so scores stay comparable
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self._reset()
         logger.info("bm25_service_init", status="initialized")
-    
+
+    def _reset(self):
+        self.corpus = []
+        self.vocab = {}
+        self.tf_csr = None
+        self.doc_lens = np.zeros(0)
+        self.doc_freqs = np.zeros(0, dtype=np.int64)
+        self.doc_len_norm = None
+        self.idf = None
+
     def index_documents(self, documents: List[str]):
-        """Index documents for BM25 search"""
-        self.corpus = documents
-        self.tokenized_corpus = [doc.lower().split() for doc in documents]
-        self.bm25 = BM25Okapi(self.tokenized_corpus)
-        
+        """Index documents for BM25 search (replaces any existing index)"""
+        self._reset()
+        self.add_documents(documents)
+
         logger.info("bm25_index_created",
                    num_documents=len(documents))
-    
+
+    def add_documents(self, documents: List[str]):
+        """Append documents to the index, tokenizing only the new ones"""
+        if not documents:
+            return
+
+        self.apply_documents(self.prepare_documents(documents))
+
+    def prepare_documents(self, documents: List[str]) -> dict:
+        """
+        Tokenize documents and build the grown index arrays, without changing the index
+
+        This is the expensive half of add_documents; apply_documents then swaps
+        the result in. Searches may run concurrently, but no other write may land
+        between the two calls.
+        """
+        tokenized = [tokenize(doc) for doc in documents]
+
+        # Term-frequency rows for the new docs, built from COO triplets;
+        # terms first seen here get the next column ids without touching the vocab yet
+        vocab = self.vocab
+        new_terms = {}
+        rows, cols, data = [], [], []
+        for doc_idx, tokens in enumerate(tokenized):
+            # Counter tallies in C; the vocab is then touched once per distinct term, not per token
+            counts = Counter(tokens)
+            rows.extend([doc_idx] * len(counts))
+            for token in counts:
+                term_idx = vocab.get(token)
+                if term_idx is None:
+                    term_idx = new_terms.setdefault(token, len(vocab) + len(new_terms))
+                cols.append(term_idx)
+            data.extend(counts.values())
+        num_terms = len(vocab) + len(new_terms)
+
+        new_rows = csr_matrix(
+            (np.asarray(data, dtype=np.float64), (rows, cols)),
+            shape=(len(documents), num_terms)
+        )
+        if self.tf_csr is None:
+            tf_csr = new_rows
+        else:
+            # Widen existing rows for terms first seen in this batch; a new matrix over the
+            # same arrays, never resized in place, since searches and snapshots still use it
+            old = self.tf_csr
+            widened = csr_matrix((old.data, old.indices, old.indptr), shape=(old.shape[0], num_terms))
+            tf_csr = vstack([widened, new_rows], format="csr")
+
+        new_lens = np.fromiter((len(tokens) for tokens in tokenized),
+                               dtype=np.float64, count=len(tokenized))
+        doc_lens = np.concatenate([self.doc_lens, new_lens])
+        doc_freqs = np.zeros(num_terms, dtype=np.int64)
+        doc_freqs[:len(self.doc_freqs)] = self.doc_freqs
+        doc_freqs += np.bincount(np.asarray(cols, dtype=np.int64), minlength=num_terms)
+
+        # avgdl and df moved, so the (cheap, vectorized) global terms are refreshed once per batch
+        doc_len_norm, idf = self._globals(doc_lens, doc_freqs, tf_csr.shape[0])
+
+        return {
+            "documents": documents,
+            "new_terms": new_terms,
+            "tf_csr": tf_csr,
+            "doc_lens": doc_lens,
+            "doc_freqs": doc_freqs,
+            "doc_len_norm": doc_len_norm,
+            "idf": idf
+        }
+
+    def apply_documents(self, prepared: dict):
+        """Swap in what prepare_documents built; O(batch), safe to hold a search lock around"""
+        self.vocab.update(prepared["new_terms"])
+        self.corpus.extend(prepared["documents"])
+        self.tf_csr = prepared["tf_csr"]
+        self.doc_lens = prepared["doc_lens"]
+        self.doc_freqs = prepared["doc_freqs"]
+        self.doc_len_norm = prepared["doc_len_norm"]
+        self.idf = prepared["idf"]
+
+        logger.info("bm25_documents_added",
+                   num_added=len(prepared["documents"]),
+                   num_documents=self.tf_csr.shape[0])
+
+    def _refresh_globals(self):
+        self.doc_len_norm, self.idf = self._globals(self.doc_lens, self.doc_freqs, self.tf_csr.shape[0])
+
+    def _globals(self, doc_lens: np.ndarray, doc_freqs: np.ndarray, num_docs: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Length normalization and IDF, which depend on the whole corpus"""
+        avgdl = doc_lens.mean() or 1.0
+        doc_len_norm = self.k1 * (1 - self.b + self.b * doc_lens / avgdl)
+        return doc_len_norm, self._compute_idf(doc_freqs, num_docs)
+
+    def _compute_idf(self, doc_freqs: np.ndarray, num_docs: int) -> np.ndarray:
+        """Okapi IDF; negative values are floored to epsilon * mean IDF"""
+        idf = np.log(num_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        floor = self.epsilon * idf.mean()
+        idf[idf < 0] = floor
+        return idf
+
+    def _score(self, query: str) -> np.ndarray:
+        """Vectorized BM25 scores for every indexed document"""
+        num_docs = self.tf_csr.shape[0]
+
+        query_terms = {}
+        for token in _tokenize_query(query):
+            term_idx = self.vocab.get(token)
+            if term_idx is not None:
+                query_terms[term_idx] = query_terms.get(term_idx, 0) + 1
+        if not query_terms:
+            return np.zeros(num_docs)
+
+        term_idx = np.fromiter(query_terms.keys(), dtype=np.int64, count=len(query_terms))
+        term_weight = np.fromiter(query_terms.values(), dtype=np.float64, count=len(query_terms))
+
+        # Only touch the non-zero tf entries of the query's columns
+        tf = self.tf_csr[:, term_idx].tocoo()
+        contrib = (self.idf[term_idx] * term_weight)[tf.col] * \
+            tf.data * (self.k1 + 1) / (tf.data + self.doc_len_norm[tf.row])
+        return np.bincount(tf.row, weights=contrib, minlength=num_docs)
+
     def search(self, query: str, top_k: int = None) -> List[Tuple[str, float]]:
         """
         Search documents using BM25
-        
+
         Args:
             query: Search query
             top_k: Number of top documents to return
-            
+
         Returns:
             List of (document, score) tuples
         """
-        if not self.bm25:
+        if self.tf_csr is None:
             logger.warning("bm25_search_no_index")
             return []
-        
+
         if top_k is None:
             top_k = settings.TOP_K_BM25
-        
-        tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
-        
+
+        scores = self._score(query)
+
         # Get top-k results
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-        
+        top_indices = np.argsort(-scores, kind="stable")[:top_k]
+
         results = [(self.corpus[i], float(scores[i])) for i in top_indices]
-        
+
         logger.info("bm25_search_completed",
                    query=query,
                    num_results=len(results),
                    top_score=results[0][1] if results else 0)
-        
+
         return results
-    
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 scores for every indexed document, as an array"""
+        if self.tf_csr is None:
+            return np.zeros(0)
+
+        return self._score(query)
+
     def get_scores(self, query: str) -> List[float]:
         """Get BM25 scores for all documents"""
-        if not self.bm25:
+        if self.tf_csr is None:
             return []
-        
-        tokenized_query = query.lower().split()
-        return self.bm25.get_scores(tokenized_query).tolist()
 
-# Singleton instance
-bm25_service = BM25SearchService()
\ No newline at end of file
+        return self._score(query).tolist()
+
+    def snapshot(self) -> dict:
+        """
+        Point-in-time copy of what scoring needs, for save_snapshot()
+
+        Arrays are shared rather than copied: writes only ever replace them.
+        The vocab grows in place, so it is copied; take the snapshot where no
+        write can land. The corpus is not included; its texts live with the caller.
+        """
+        return {
+            "params": [self.k1, self.b, self.epsilon],
+            # Term order is the column order of tf_csr
+            "vocab": list(self.vocab),
+            "tf_csr": self.tf_csr,
+            "doc_lens": self.doc_lens,
+            "doc_freqs": self.doc_freqs
+        }
+
+    def save(self, directory: str, **extra):
+        """Write the current index to directory (see save_snapshot)"""
+        self.save_snapshot(directory, self.snapshot(), **extra)
+
+    @staticmethod
+    def save_snapshot(directory: str, snapshot: dict, **extra):
+        """
+        Write a snapshot() to directory as bm25.npz (arrays) + bm25.json (vocab, extra)
+
+        Both files carry the same stamp, so a crash between the two writes
+        is detected by load() instead of pairing mismatched halves.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = uuid.uuid4().hex
+        tf = snapshot["tf_csr"] if snapshot["tf_csr"] is not None else csr_matrix((0, 0))
+
+        arrays_path = os.path.join(directory, STATE_ARRAYS_FILE)
+        with open(arrays_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                data=tf.data,
+                indices=tf.indices,
+                indptr=tf.indptr,
+                shape=np.asarray(tf.shape),
+                doc_lens=snapshot["doc_lens"],
+                doc_freqs=snapshot["doc_freqs"],
+                stamp=np.asarray(stamp)
+            )
+
+        meta_path = os.path.join(directory, STATE_META_FILE)
+        with open(meta_path + ".tmp", "wb") as f:
+            f.write(orjson.dumps({
+                "version": STATE_VERSION,
+                "stamp": stamp,
+                "params": snapshot["params"],
+                "vocab": snapshot["vocab"],
+                "extra": extra
+            }))
+
+        os.replace(arrays_path + ".tmp", arrays_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        logger.info("bm25_index_saved",
+                   path=directory,
+                   num_documents=tf.shape[0])
+
+    @classmethod
+    def load(cls, directory: str) -> Tuple["BM25SearchService", dict] | None:
+        """
+        Index written by save() and its extra fields; None if missing, stale or from another version
+
+        The corpus is not saved, so the loaded service scores but has no texts
+        until the caller restores corpus.
+        """
+        arrays_path = os.path.join(directory, STATE_ARRAYS_FILE)
+        meta_path = os.path.join(directory, STATE_META_FILE)
+        if not (os.path.exists(arrays_path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path, "rb") as f:
+            meta = orjson.loads(f.read())
+        if meta.get("version") != STATE_VERSION:
+            logger.info("bm25_saved_index_outdated", version=meta.get("version"))
+            return None
+
+        with np.load(arrays_path) as arrays:
+            if str(arrays["stamp"]) != meta["stamp"]:
+                logger.warning("bm25_saved_index_mismatched", path=directory)
+                return None
+
+            k1, b, epsilon = meta["params"]
+            service = cls(k1=k1, b=b, epsilon=epsilon)
+            service.vocab = {term: idx for idx, term in enumerate(meta["vocab"])}
+            service.doc_lens = arrays["doc_lens"]
+            service.doc_freqs = arrays["doc_freqs"]
+            shape = tuple(arrays["shape"])
+            if shape[0]:
+                service.tf_csr = csr_matrix(
+                    (arrays["data"], arrays["indices"], arrays["indptr"]),
+                    shape=shape
+                )
+                service._refresh_globals()
+
+        logger.info("bm25_index_loaded",
+                   path=directory,
+                   num_documents=shape[0])
+
+        return service, meta["extra"]
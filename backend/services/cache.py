@@ -1,22 +1,30 @@
 import redis
-import json
-import hashlib
+import orjson
+import xxhash
+from concurrent.futures import ThreadPoolExecutor
 from config import settings
 import structlog
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable, Callable, Tuple
 
 logger = structlog.get_logger()
 
+# Background SETs from get_or_set; kept off the default executor, which runs retrieval's to_thread work
+_WRITE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-write")
+
 class CacheService:
     """Redis-based caching service"""
     
     def __init__(self):
         try:
-            self.client = redis.Redis(
+            # Shared pool: sockets are reused across requests instead of reconnecting
+            pool = redis.BlockingConnectionPool(
                 host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
+                max_connections=64,
+                timeout=5,
                 decode_responses=True
             )
+            self.client = redis.Redis(connection_pool=pool)
             self.client.ping()
             logger.info("cache_service_init", status="connected")
         except Exception as e:
@@ -25,7 +33,7 @@ class CacheService:
     
     def _generate_key(self, prefix: str, value: str) -> str:
         """Generate cache key with hash"""
-        hash_value = hashlib.md5(value.encode()).hexdigest()
+        hash_value = xxhash.xxh3_64_hexdigest(value.encode())
         return f"{prefix}:{hash_value}"
     
     def get(self, key: str) -> Optional[Any]:
@@ -37,7 +45,7 @@ class CacheService:
             value = self.client.get(key)
             if value:
                 logger.info("cache_hit", key=key)
-                return json.loads(value)
+                return orjson.loads(value)
             logger.info("cache_miss", key=key)
             return None
         except Exception as e:
@@ -56,7 +64,7 @@ class CacheService:
             self.client.setex(
                 key,
                 ttl,
-                json.dumps(value)
+                orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
             )
             logger.info("cache_set", key=key, ttl=ttl)
             return True
@@ -64,6 +72,28 @@ class CacheService:
             logger.error("cache_set_error", key=key, error=str(e))
             return False
     
+    async def get_or_set(self,
+                         key: str,
+                         factory: Callable[[], Awaitable[Any]],
+                         ttl: int = None) -> Tuple[Any, bool]:
+        """
+        Get value from cache, computing it with factory on a miss
+        
+        The SET for a computed value is issued on a dedicated writer thread so
+        the caller only waits for the GET round-trip.
+        
+        Returns:
+            (value, cache_hit) tuple
+        """
+        cached = self.get(key)
+        if cached:
+            return cached, True
+        
+        value = await factory()
+        if self.client:
+            _WRITE_POOL.submit(self.set, key, value, ttl)
+        return value, False
+    
     def delete(self, key: str) -> bool:
         """Delete key from cache"""
         if not self.client:
@@ -1,114 +1,219 @@
-import json
+import copy
+import orjson
 import os
+from cachetools import TTLCache
 import sqlite3
 import structlog
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 
 from config import settings
 
 logger = structlog.get_logger()
 
+# Statements are shared constants so the connection's prepared-statement
+# cache is keyed on the exact same string every call
+_SQL_INSERT_CONV = """
+    INSERT INTO conversations (id, title)
+    VALUES (?, ?)
+"""
+_SQL_INSERT_MSG = """
+    INSERT INTO messages (id, conversation_id, role, content, metadata)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_SQL_SELECT_HISTORY = """
+    SELECT id, role, content, metadata, created_at
+    FROM messages
+    WHERE conversation_id = ?
+    ORDER BY created_at ASC
+    LIMIT ?
+"""
+_SQL_SELECT_CONV = "SELECT * FROM conversations WHERE id = ?"
+_SQL_SELECT_ALL_CONVS = """
+    SELECT id, title, created_at, updated_at, message_count
+    FROM conversations
+    ORDER BY updated_at DESC
+    LIMIT ?
+"""
+_SQL_UPDATE_TITLE = """
+    UPDATE conversations
+    SET title = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+_SQL_DELETE_CONV = "DELETE FROM conversations WHERE id = ?"
+_SQL_EXPORT_MESSAGES = """
+    SELECT * FROM messages WHERE conversation_id = ?
+    ORDER BY created_at ASC
+"""
+
+def _dump_metadata(metadata: Dict | None) -> str | None:
+    """Serialize message metadata to compact JSON text (NULL when empty)"""
+    if not metadata:
+        return None
+    return orjson.dumps(
+        metadata, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    ).decode()
+
 class ChatHistoryService:
     """Manage chat conversations with history"""
     
     def __init__(self, db_path: str | None = None):
         self.db_path = db_path or settings.CHAT_HISTORY_DB_PATH
+        self._local = threading.local()
+        
+        # Sidebar listing cached until the next write; writes bump the version
+        self._version = 0
+        self._sidebar_cache: tuple[int, int, List[Dict]] | None = None
+        self._cache_lock = threading.Lock()
+        
+        # Per-conversation reads (row and history by limit), dropped when that conversation is written
+        self._conversation_cache = TTLCache(maxsize=512, ttl=30)
+        self._history_cache = TTLCache(maxsize=512, ttl=30)
+        
         self._ensure_directory()
         self._init_db()
         logger.info("chat_history_service_init", db_path=self.db_path)
-
+    
     def _ensure_directory(self):
         directory = os.path.dirname(self.db_path)
         if directory and not os.path.exists(directory):
             os.makedirs(directory, exist_ok=True)
     
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the service PRAGMAs applied"""
+        # Autocommit mode: single statements commit on their own,
+        # multi-statement writes use _transaction()
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        if self.db_path != ":memory:":
+            # Readers don't block the writer, and commits append to the WAL
+            # instead of rewriting a rollback journal
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Long-lived connection for the calling thread, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run several statements under one BEGIN/COMMIT"""
+        conn = self._conn()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+    
+    def _invalidate(self, conversation_id: str | None = None):
+        """Mark cached reads stale after a write"""
+        with self._cache_lock:
+            self._version += 1
+            if conversation_id is not None:
+                self._conversation_cache.pop(conversation_id, None)
+                self._history_cache.pop(conversation_id, None)
+    
     def _init_db(self):
         """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Conversations table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                message_count INTEGER DEFAULT 0
-            )
-        """)
-        
-        # Messages table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id TEXT PRIMARY KEY,
-                conversation_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                metadata TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            # Conversations table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    message_count INTEGER DEFAULT 0
+                )
+            """)
+            
+            # Messages table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    conversation_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    metadata TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+                )
+            """)
+            
+            # History/export read one conversation in created_at order
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_conv_created
+                ON messages(conversation_id, created_at)
+            """)
+            
+            # Message counter and recency maintained by SQLite, so add_message is one INSERT
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_msg_count
+                AFTER INSERT ON messages
+                BEGIN
+                    UPDATE conversations
+                    SET message_count = message_count + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = NEW.conversation_id;
+                END
+            """)
+            
+            # Sidebar lists conversations by recency
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conv_updated
+                ON conversations(updated_at DESC)
+            """)
         
         logger.info("chat_history_db_initialized")
     
     def create_conversation(self, title: str = "New Chat") -> str:
         """Create a new conversation"""
-        conversation_id = str(uuid.uuid4())
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO conversations (id, title)
-            VALUES (?, ?)
-        """, (conversation_id, title))
+        conversation_id = uuid.uuid4().hex
         
-        conn.commit()
-        conn.close()
+        self._conn().execute(_SQL_INSERT_CONV, (conversation_id, title))
+        self._invalidate()
         
         logger.info("conversation_created", id=conversation_id, title=title)
         
         return conversation_id
     
     def add_message(
-        self, 
-        conversation_id: str, 
-        role: str, 
+        self,
+        conversation_id: str,
+        role: str,
         content: str,
         metadata: Dict = None
     ) -> str:
         """Add a message to a conversation"""
-        message_id = str(uuid.uuid4())
-        metadata_str = json.dumps(metadata) if metadata else None
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Insert message
-        cursor.execute("""
-            INSERT INTO messages (id, conversation_id, role, content, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        """, (message_id, conversation_id, role, content, metadata_str))
-        
-        # Update conversation
-        cursor.execute("""
-            UPDATE conversations 
-            SET updated_at = CURRENT_TIMESTAMP,
-                message_count = message_count + 1
-            WHERE id = ?
-        """, (conversation_id,))
+        message_id = uuid.uuid4().hex
+        metadata_str = _dump_metadata(metadata)
         
-        conn.commit()
-        conn.close()
+        # trg_msg_count bumps the conversation's message_count/updated_at
+        self._conn().execute(
+            _SQL_INSERT_MSG, (message_id, conversation_id, role, content, metadata_str)
+        )
+        self._invalidate(conversation_id)
         
-        logger.info("message_added", 
+        logger.info("message_added",
                    conversation_id=conversation_id,
                    role=role,
                    message_id=message_id)
@@ -117,123 +222,95 @@ class ChatHistoryService:
     
     def get_conversation_history(self, conversation_id: str, limit: int = 50) -> List[Dict]:
         """Get all messages in a conversation"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, role, content, metadata, created_at
-            FROM messages
-            WHERE conversation_id = ?
-            ORDER BY created_at ASC
-            LIMIT ?
-        """, (conversation_id, limit))
-        
-        messages = []
-        for row in cursor.fetchall():
-            msg = {
-                "id": row["id"],
-                "role": row["role"],
-                "content": row["content"],
-                "created_at": row["created_at"]
-            }
-            if row["metadata"]:
-                msg["metadata"] = json.loads(row["metadata"])
-            messages.append(msg)
-        
-        conn.close()
-        
-        return messages
+        with self._cache_lock:
+            version = self._version
+            cached = self._history_cache.get(conversation_id, {}).get(limit)
+        if cached is not None:
+            # Deep copy: message dicts (and their metadata) must not be shared with the cache
+            return copy.deepcopy(cached)
+        
+        rows = self._conn().execute(_SQL_SELECT_HISTORY, (conversation_id, limit)).fetchall()
+        
+        # Only rows that carry metadata pay for a JSON parse
+        messages = [
+            dict(row, metadata=orjson.loads(row["metadata"]) if row["metadata"] else None)
+            for row in rows
+        ]
+        
+        with self._cache_lock:
+            # Skip caching if a write landed while we were reading
+            if self._version == version:
+                self._history_cache.setdefault(conversation_id, {})[limit] = messages
+        
+        return copy.deepcopy(messages)
     
     def get_conversation(self, conversation_id: str) -> Optional[Dict]:
         """Get a single conversation row"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM conversations WHERE id = ?
-        """, (conversation_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        return dict(row) if row else None
+        with self._cache_lock:
+            version = self._version
+            cached = self._conversation_cache.get(conversation_id)
+        if cached is not None:
+            return dict(cached)
+        
+        row = self._conn().execute(_SQL_SELECT_CONV, (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        
+        conversation = dict(row)
+        with self._cache_lock:
+            if self._version == version:
+                self._conversation_cache[conversation_id] = conversation
+        
+        return dict(conversation)
     
     def get_all_conversations(self, limit: int = 50) -> List[Dict]:
         """Get all conversations (for sidebar)"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, title, created_at, updated_at, message_count
-            FROM conversations
-            ORDER BY updated_at DESC
-            LIMIT ?
-        """, (limit,))
+        with self._cache_lock:
+            version = self._version
+            cached = self._sidebar_cache
+        if cached is not None and cached[0] == version and cached[1] == limit:
+            return [dict(conversation) for conversation in cached[2]]
         
+        cursor = self._conn().execute(_SQL_SELECT_ALL_CONVS, (limit,))
         conversations = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         
-        return conversations
+        # Tagged with the version read before the query, so a concurrent write makes it stale
+        with self._cache_lock:
+            self._sidebar_cache = (version, limit, conversations)
+        
+        return [dict(conversation) for conversation in conversations]
     
     def update_conversation_title(self, conversation_id: str, title: str):
         """Update conversation title"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE conversations 
-            SET title = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (title, conversation_id))
-        
-        conn.commit()
-        conn.close()
+        self._conn().execute(_SQL_UPDATE_TITLE, (title, conversation_id))
+        self._invalidate(conversation_id)
         
         logger.info("conversation_title_updated", id=conversation_id, title=title)
     
     def delete_conversation(self, conversation_id: str):
         """Delete a conversation and all its messages"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-        
-        conn.commit()
-        conn.close()
+        self._conn().execute(_SQL_DELETE_CONV, (conversation_id,))
+        self._invalidate(conversation_id)
         
         logger.info("conversation_deleted", id=conversation_id)
     
     def export_conversation(self, conversation_id: str) -> Dict:
         """Export conversation as JSON"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        conn = self._conn()
         
         # Get conversation info
-        cursor.execute("""
-            SELECT * FROM conversations WHERE id = ?
-        """, (conversation_id,))
-        
-        conversation = dict(cursor.fetchone())
+        conversation = dict(conn.execute(_SQL_SELECT_CONV, (conversation_id,)).fetchone())
         
         # Get messages
-        cursor.execute("""
-            SELECT * FROM messages WHERE conversation_id = ?
-            ORDER BY created_at ASC
-        """, (conversation_id,))
+        cursor = conn.execute(_SQL_EXPORT_MESSAGES, (conversation_id,))
         
         messages = []
         for row in cursor.fetchall():
             msg = dict(row)
             if msg.get("metadata"):
-                msg["metadata"] = json.loads(msg["metadata"])
+                msg["metadata"] = orjson.loads(msg["metadata"])
             messages.append(msg)
         
-        conn.close()
-        
         return {
             "conversation": conversation,
             "messages": messages,
@@ -242,30 +319,26 @@ class ChatHistoryService:
     
     def import_conversation(self, data: Dict) -> str:
         """Import a conversation from JSON"""
-        conversation_id = str(uuid.uuid4())
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create conversation
-        conv = data["conversation"]
-        cursor.execute("""
-            INSERT INTO conversations (id, title, message_count)
-            VALUES (?, ?, ?)
-        """, (conversation_id, conv.get("title", "Imported Chat"), len(data["messages"])))
+        conversation_id = uuid.uuid4().hex
         
-        # Import messages
-        for msg in data["messages"]:
-            message_id = str(uuid.uuid4())
-            metadata_str = json.dumps(msg.get("metadata")) if msg.get("metadata") else None
+        with self._transaction() as cursor:
+            # Create conversation
+            conv = data["conversation"]
+            cursor.execute(_SQL_INSERT_CONV, (conversation_id, conv.get("title", "Imported Chat")))
             
-            cursor.execute("""
-                INSERT INTO messages (id, conversation_id, role, content, metadata)
-                VALUES (?, ?, ?, ?, ?)
-            """, (message_id, conversation_id, msg["role"], msg["content"], metadata_str))
-        
-        conn.commit()
-        conn.close()
+            # Import messages with a single prepared statement (trg_msg_count does the counting)
+            rows = [
+                (
+                    uuid.uuid4().hex,
+                    conversation_id,
+                    msg["role"],
+                    msg["content"],
+                    _dump_metadata(msg.get("metadata"))
+                )
+                for msg in data["messages"]
+            ]
+            cursor.executemany(_SQL_INSERT_MSG, rows)
+        self._invalidate()
         
         logger.info("conversation_imported", id=conversation_id, messages=len(data["messages"]))
         
@@ -1,9 +1,18 @@
 from sentence_transformers import SentenceTransformer
+from cachetools import LRUCache
 from config import settings
+import asyncio
+import numpy as np
 import structlog
+import threading
+import torch
 
 logger = structlog.get_logger()
 
+# Concurrent embed_text_async calls are coalesced into one encode() pass
+EMBED_BATCH_MAX = 32
+EMBED_BATCH_WAIT_S = 0.005
+
 class EmbeddingService:
     def __init__(self):
         logger.info("embedding_service_init", 
@@ -12,17 +21,99 @@ class EmbeddingService:
         
         self.model = SentenceTransformer(settings.EMBEDDING_MODEL)
         
+        if settings.EMBEDDING_INT8 and self.model.device.type == "cpu":
+            # int8 weights for the encoder's Linear layers (VNNI/AVX2 GEMMs on CPU)
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.info("embedding_model_quantized", dtype="qint8")
+        
+        # Query embeddings repeat across variations and correction loops
+        self._query_cache = LRUCache(maxsize=2048)
+        self._query_cache_lock = threading.Lock()
+        
+        # Batching queue, bound to the running loop on first async call
+        self._queue: asyncio.Queue | None = None
+        self._batch_task: asyncio.Task | None = None
+        
         logger.info("embedding_service_init", 
                    model=settings.EMBEDDING_MODEL,
                    status="ready")
     
-    def embed_text(self, text: str) -> list[float]:
-        """Embed a single text"""
-        return self.model.encode(text).tolist()
+    def embed_text(self, text: str) -> np.ndarray:
+        """Embed a single text (float32 vector)"""
+        return self.model.encode(text, convert_to_numpy=True)
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a search query, memoized by query text"""
+        with self._query_cache_lock:
+            cached = self._query_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        embedding = self.embed_text(text)
+        with self._query_cache_lock:
+            self._query_cache[text] = embedding
+        return embedding
+    
+    async def embed_text_async(self, text: str) -> np.ndarray:
+        """Embed a single text without blocking the event loop, batched with concurrent callers"""
+        if self._batch_task is None or self._batch_task.done():
+            self._queue = asyncio.Queue()
+            self._batch_task = asyncio.create_task(self._batch_worker())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        """Async embed_query: memoized, misses go through the batching queue"""
+        with self._query_cache_lock:
+            cached = self._query_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        embedding = await self.embed_text_async(text)
+        with self._query_cache_lock:
+            self._query_cache[text] = embedding
+        return embedding
+    
+    async def _batch_worker(self):
+        """Drain queued texts (up to EMBED_BATCH_MAX or EMBED_BATCH_WAIT_S) into one encode() call"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + EMBED_BATCH_WAIT_S
+            while len(batch) < EMBED_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(
+                    None,
+                    lambda: self.model.encode(
+                        texts, batch_size=EMBED_BATCH_MAX, show_progress_bar=False, convert_to_numpy=True
+                    )
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
     
-    def embed_batch(self, texts: list[str]) -> list[list[float]]:
-        """Embed multiple texts in batch"""
-        return self.model.encode(texts, show_progress_bar=False).tolist()
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        """Embed multiple texts in batch (float32 matrix, one row per text)"""
+        return self.model.encode(texts, show_progress_bar=False, convert_to_numpy=True)
     
     def get_embedding_dimension(self) -> int:
         """Get embedding vector dimension"""
@@ -0,0 +1,98 @@
+from config import settings
+import hashlib
+import numpy as np
+import os
+import sqlite3
+import structlog
+import threading
+from typing import Dict, List
+
+logger = structlog.get_logger()
+
+# Keys per SELECT ... IN (...), below SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+# Vectors are stored at half precision: half the disk, well within cosine-similarity noise
+STORAGE_DTYPE = np.float16
+
+class EmbeddingCache:
+    """On-disk chunk embedding cache keyed by sha256(model id + normalized text), stored as float16"""
+    
+    def __init__(self, db_path: str = None, model_id: str = None):
+        self.db_path = db_path or settings.EMBEDDING_CACHE_DB_PATH
+        # Quantized weights give slightly different vectors, so they get their own keys
+        self.model_id = model_id or settings.EMBEDDING_MODEL + ("|int8" if settings.EMBEDDING_INT8 else "")
+        self._local = threading.local()
+        self._ensure_directory()
+        self._init_db()
+        logger.info("embedding_cache_init", db_path=self.db_path, model=self.model_id)
+    
+    def _ensure_directory(self):
+        directory = os.path.dirname(self.db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the cache PRAGMAs applied"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256
+        )
+        if self.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Long-lived connection for the calling thread, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
+    def _init_db(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS embeddings_f16 (
+                hash BLOB PRIMARY KEY,
+                vec BLOB NOT NULL
+            ) WITHOUT ROWID
+        """)
+    
+    def key(self, text: str) -> bytes:
+        """Cache key; whitespace runs are collapsed since the tokenizer ignores them"""
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_id}\x00{normalized}".encode()).digest()
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Cached vectors (float16; upcast on assignment into a float32 matrix) for the keys that are present"""
+        conn = self._conn()
+        found = {}
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for key, vec in conn.execute(
+                f"SELECT hash, vec FROM embeddings_f16 WHERE hash IN ({placeholders})", batch
+            ):
+                found[key] = np.frombuffer(vec, dtype=STORAGE_DTYPE)
+        return found
+    
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """Store vectors (one row per key) in a single transaction"""
+        vectors = np.ascontiguousarray(vectors, dtype=STORAGE_DTYPE)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings_f16 (hash, vec) VALUES (?, ?)",
+                zip(keys, (vector.tobytes() for vector in vectors))
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+# Singleton instance
+embedding_cache = EmbeddingCache()
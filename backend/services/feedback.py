@@ -1,5 +1,7 @@
+import orjson
 import sqlite3
 import structlog
+import threading
 from datetime import datetime
 from typing import List, Dict
 import os
@@ -11,15 +13,43 @@ class FeedbackService:
     
     def __init__(self, db_path: str = "/app/feedback.db"):
         self.db_path = db_path
+        self._local = threading.local()
         self._init_db()
         logger.info("feedback_service_init", db_path=db_path)
     
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the service PRAGMAs applied"""
+        # Autocommit mode: each statement commits on its own
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        if self.db_path != ":memory:":
+            # Readers don't block the writer, and commits append to the WAL
+            # instead of rewriting a rollback journal
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Long-lived connection for the calling thread, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
     def _init_db(self):
         """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self._conn()
         
-        cursor.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS feedback (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 query TEXT NOT NULL,
@@ -33,8 +63,9 @@ class FeedbackService:
             )
         """)
         
-        conn.commit()
-        conn.close()
+        # Recent-first listings, overall and dislikes only
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_ts ON feedback(timestamp DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_neg ON feedback(feedback, timestamp DESC)")
         
         logger.info("feedback_db_initialized")
     
@@ -61,21 +92,19 @@ class FeedbackService:
         Returns:
             Feedback ID
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         sources_str = "\n---\n".join(sources) if sources else ""
-        metadata_str = str(metadata) if metadata else ""
+        # Real JSON (queryable with json_extract), NULL rather than "" when absent
+        metadata_str = orjson.dumps(
+            metadata, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode() if metadata else None
         
-        cursor.execute("""
+        cursor = self._conn().execute("""
             INSERT INTO feedback 
             (query, answer, sources, feedback, correction_attempts, response_time_ms, metadata)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (query, answer, sources_str, feedback, correction_attempts, response_time_ms, metadata_str))
         
         feedback_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
         logger.info("feedback_added",
                    feedback_id=feedback_id,
@@ -86,39 +115,31 @@ class FeedbackService:
     
     def get_all_feedback(self, limit: int = 100) -> List[Dict]:
         """Get all feedback entries"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+        cursor = self._conn().execute("""
             SELECT * FROM feedback 
             ORDER BY timestamp DESC 
             LIMIT ?
         """, (limit,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [dict(row) for row in rows]
     
     def get_feedback_stats(self) -> Dict:
         """Get feedback statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM feedback")
-        total = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM feedback WHERE feedback = 1")
-        likes = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM feedback WHERE feedback = 0")
-        dislikes = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT AVG(response_time_ms) FROM feedback")
-        avg_response_time = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        # One scan computes every aggregate
+        total, likes, dislikes, avg_response_time = self._conn().execute("""
+            SELECT COUNT(*),
+                   SUM(CASE WHEN feedback = 1 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN feedback = 0 THEN 1 ELSE 0 END),
+                   AVG(response_time_ms)
+            FROM feedback
+        """).fetchone()
+        
+        # SUM/AVG are NULL on an empty table
+        likes = likes or 0
+        dislikes = dislikes or 0
+        avg_response_time = avg_response_time or 0
         
         satisfaction_rate = (likes / total * 100) if total > 0 else 0
         
@@ -132,11 +153,7 @@ class FeedbackService:
     
     def get_negative_feedback(self, limit: int = 20) -> List[Dict]:
         """Get recent negative feedback for review"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+        cursor = self._conn().execute("""
             SELECT * FROM feedback 
             WHERE feedback = 0
             ORDER BY timestamp DESC 
@@ -144,9 +161,13 @@ class FeedbackService:
         """, (limit,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [dict(row) for row in rows]
+    
+    def reset(self):
+        """Delete all feedback entries"""
+        self._conn().execute("DELETE FROM feedback")
+        logger.info("feedback_reset")
 
 # Singleton instance
-feedback_service = FeedbackService()
\ No newline at end of file
+feedback_service = FeedbackService()
@@ -1,6 +1,9 @@
+import asyncio
 import os
+import random
 import sqlite3
 import structlog
+import threading
 import time
 from typing import Dict, List
 
@@ -9,6 +12,18 @@ from config import settings
 
 logger = structlog.get_logger()
 
+INSERT_SQL = """
+    INSERT INTO query_metrics
+    (query, mode, latency_ms, was_corrected, retrieval_score, cache_hit, error)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Background writer: flush after this many queued rows or this long after the first one
+FLUSH_BATCH_SIZE = 100
+FLUSH_INTERVAL_S = 0.1
+
+# Latency percentiles come from a uniform reservoir sample (exact up to this many queries)
+LATENCY_RESERVOIR_SIZE = 4096
 
 class MetricsTracker:
     """Track and aggregate system metrics with SQLite persistence"""
@@ -16,8 +31,20 @@ class MetricsTracker:
     def __init__(self, db_path: str | None = None):
         self.db_path = db_path or settings.METRICS_DB_PATH
         self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._queue: asyncio.Queue | None = None
+        self._flush_task: asyncio.Task | None = None
+
+        # Rolling latency aggregates, so get_metrics never reads every latency row
+        self._stats_lock = threading.Lock()
+        self._rng = random.Random()
+        self._latency_count = 0
+        self._latency_sum = 0.0
+        self._latency_sample: List[float] = []
         self._ensure_directory()
+        self._conn = self._connect()
         self._init_db()
+        self._seed_latency_stats()
         logger.info("metrics_tracker_init", db_path=self.db_path)
 
     def _ensure_directory(self):
@@ -25,10 +52,17 @@ class MetricsTracker:
         if directory and not os.path.exists(directory):
             os.makedirs(directory, exist_ok=True)
 
+    def _connect(self) -> sqlite3.Connection:
+        """One shared autocommit connection, WAL so appends don't rewrite a rollback journal"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        if self.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        self._conn.execute(
             """
             CREATE TABLE IF NOT EXISTS query_metrics (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -43,8 +77,13 @@ class MetricsTracker:
             )
             """
         )
-        conn.commit()
-        conn.close()
+        # Covers the per-mode GROUP BY: grouped in index order without touching the table
+        self._conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_qm_mode
+            ON query_metrics(mode, was_corrected, latency_ms, retrieval_score)
+            """
+        )
         logger.info("metrics_db_initialized")
 
     def record_query(
@@ -57,27 +96,22 @@ class MetricsTracker:
         error: bool = False,
         mode: str = "fast",
     ):
-        """Persist a query execution snapshot"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO query_metrics
-            (query, mode, latency_ms, was_corrected, retrieval_score, cache_hit, error)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                query,
-                mode,
-                latency_ms,
-                1 if was_corrected else 0,
-                retrieval_score,
-                1 if cache_hit else 0,
-                1 if error else 0,
-            ),
+        """Persist a query execution snapshot (queued for the background writer once started)"""
+        row = (
+            query,
+            mode,
+            latency_ms,
+            1 if was_corrected else 0,
+            retrieval_score,
+            1 if cache_hit else 0,
+            1 if error else 0,
         )
-        conn.commit()
-        conn.close()
+        if latency_ms is not None:
+            self._observe_latency(latency_ms)
+        if self._flush_task is not None and not self._flush_task.done():
+            self._queue.put_nowait(row)
+        else:
+            self._write_rows([row])
 
         logger.info(
             "metric_recorded",
@@ -89,9 +123,108 @@ class MetricsTracker:
             error=error,
         )
 
-    def _get_latencies(self, cursor) -> List[float]:
+    def start(self):
+        """Start the background writer; must be called from the running event loop"""
+        if self._flush_task is None or self._flush_task.done():
+            self._queue = asyncio.Queue()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background writer and persist anything still queued"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self._flush_pending()
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = [await self._queue.get()]
+            deadline = loop.time() + FLUSH_INTERVAL_S
+            try:
+                while len(rows) < FLUSH_BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        rows.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # stop() landed mid-batch: these rows are off the queue, so _flush_pending can't see them
+                self._write_rows(rows)
+                raise
+            # A cancel during the write below is harmless: the worker thread still commits the batch
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except Exception as e:
+                logger.error("metrics_flush_error", rows=len(rows), error=str(e))
+
+    def _flush_pending(self):
+        """Write queued rows synchronously so reads see every recorded query"""
+        if self._queue is None:
+            return
+        rows = []
+        while not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        if rows:
+            self._write_rows(rows)
+
+    def _write_rows(self, rows: List[tuple]):
+        """Insert a batch of rows in one transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(INSERT_SQL, rows)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _seed_latency_stats(self):
+        """Rebuild the rolling aggregates from rows persisted by earlier runs"""
+        with self._lock:
+            latencies = self._get_latencies(self._conn.cursor())
+        if len(latencies) > LATENCY_RESERVOIR_SIZE:
+            # A uniform sample without replacement is a valid reservoir state
+            sample = self._rng.sample(range(len(latencies)), LATENCY_RESERVOIR_SIZE)
+            reservoir = latencies[sample]
+        else:
+            reservoir = latencies
+        with self._stats_lock:
+            self._latency_count = len(latencies)
+            self._latency_sum = float(latencies.sum())
+            self._latency_sample = reservoir.tolist()
+
+    def _observe_latency(self, latency_ms: float):
+        with self._stats_lock:
+            self._latency_count += 1
+            self._latency_sum += latency_ms
+            if len(self._latency_sample) < LATENCY_RESERVOIR_SIZE:
+                self._latency_sample.append(latency_ms)
+            else:
+                slot = self._rng.randrange(self._latency_count)
+                if slot < LATENCY_RESERVOIR_SIZE:
+                    self._latency_sample[slot] = latency_ms
+
+    def _latency_stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            count = self._latency_count
+            total = self._latency_sum
+            sample = np.array(self._latency_sample)
+        if not count:
+            return {"avg": 0.0, "p95": 0.0, "p99": 0.0}
+        p95, p99 = np.percentile(sample, [95, 99])  # one partition pass for both
+        return {"avg": total / count, "p95": float(p95), "p99": float(p99)}
+
+    def _get_latencies(self, cursor) -> np.ndarray:
         cursor.execute("SELECT latency_ms FROM query_metrics WHERE latency_ms IS NOT NULL")
-        return [row[0] for row in cursor.fetchall()]
+        # Straight from the cursor into a float64 buffer, no intermediate list of rows
+        return np.fromiter((row[0] for row in cursor), dtype=np.float64)
 
     def _get_mode_breakdown(self, cursor) -> Dict[str, dict]:
         cursor.execute(
@@ -117,14 +250,25 @@ class MetricsTracker:
 
     def get_metrics(self) -> Dict:
         """Aggregate metrics from persistent storage"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self._flush_pending()
+        with self._lock:
+            return self._aggregate(self._conn.cursor())
 
-        cursor.execute("SELECT COUNT(*) FROM query_metrics")
-        total_queries = cursor.fetchone()[0]
+    def _aggregate(self, cursor) -> Dict:
+        # Every table-wide aggregate in one scan
+        cursor.execute(
+            """
+            SELECT COUNT(*),
+                   COALESCE(SUM(was_corrected), 0),
+                   COALESCE(SUM(error), 0),
+                   COALESCE(SUM(cache_hit), 0),
+                   COALESCE(AVG(retrieval_score), 0.0)
+            FROM query_metrics
+            """
+        )
+        total_queries, total_corrections, total_errors, cache_hits, avg_retrieval = cursor.fetchone()
 
         if total_queries == 0:
-            conn.close()
             return {
                 "total_queries": 0,
                 "total_corrections": 0,
@@ -139,31 +283,19 @@ class MetricsTracker:
                 "mode_breakdown": {},
             }
 
-        cursor.execute("SELECT SUM(was_corrected) FROM query_metrics")
-        total_corrections = cursor.fetchone()[0] or 0
-
-        cursor.execute("SELECT SUM(error) FROM query_metrics")
-        total_errors = cursor.fetchone()[0] or 0
-
-        cursor.execute("SELECT SUM(cache_hit) FROM query_metrics")
-        cache_hits = cursor.fetchone()[0] or 0
         cache_requests = total_queries
 
-        cursor.execute("SELECT AVG(retrieval_score) FROM query_metrics")
-        avg_retrieval = cursor.fetchone()[0] or 0.0
-
-        latencies = self._get_latencies(cursor)
+        latency = self._latency_stats()
 
         mode_breakdown = self._get_mode_breakdown(cursor)
-        conn.close()
 
         return {
             "total_queries": total_queries,
             "total_corrections": total_corrections,
             "correction_rate": total_corrections / total_queries if total_queries else 0.0,
-            "avg_latency_ms": float(np.mean(latencies)) if latencies else 0.0,
-            "p95_latency_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
-            "p99_latency_ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+            "avg_latency_ms": latency["avg"],
+            "p95_latency_ms": latency["p95"],
+            "p99_latency_ms": latency["p99"],
             "error_rate": total_errors / total_queries if total_queries else 0.0,
             "cache_hit_rate": cache_hits / cache_requests if cache_requests else 0.0,
             "avg_retrieval_score": avg_retrieval,
@@ -173,11 +305,13 @@ class MetricsTracker:
 
     def reset(self):
         """Clear persisted metrics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM query_metrics")
-        conn.commit()
-        conn.close()
+        self._flush_pending()
+        with self._lock:
+            self._conn.execute("DELETE FROM query_metrics")
+        with self._stats_lock:
+            self._latency_count = 0
+            self._latency_sum = 0.0
+            self._latency_sample = []
         self.start_time = time.time()
         logger.info("metrics_reset")
 
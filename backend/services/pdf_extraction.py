@@ -0,0 +1,195 @@
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+import pypdfium2 as pdfium
+from config import settings
+import multiprocessing
+import os
+import structlog
+import threading
+from itertools import repeat
+from typing import Iterator, List, Tuple
+
+logger = structlog.get_logger()
+
+# Pages per worker task; every task re-opens the PDF, so ranges amortize the open
+PAGES_PER_TASK = 8
+
+# Pages with less text than this are skipped (blank, scanned or cover pages)
+MIN_PAGE_CHARS = 10
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+# PDFium is not thread-safe. In-process use (page counts, small PDFs, a single worker)
+# can come from concurrent upload threads, so it is serialized; each worker process
+# has its own PDFium and its own uncontended lock.
+_pdfium_lock = threading.Lock()
+
+def _keep_page(pages_data: List[Tuple[int, str]], index: int, text: str):
+    if text and len(text.strip()) > MIN_PAGE_CHARS:
+        pages_data.append((index + 1, text))
+
+def _page_extract_error(pdf_path: str, index: int, error: Exception):
+    logger.warning("page_extract_error",
+                 file=os.path.basename(pdf_path),
+                 page=index + 1,
+                 error=str(error))
+
+def _extract_range_pdfium(pdf: pdfium.PdfDocument, pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """(page_number, text) for pages [start, stop), 1-based page numbers, via PDFium's C text layer"""
+    pages_data = []
+    for i in range(start, stop):
+        try:
+            page = pdf[i]
+            try:
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                textpage.close()
+            finally:
+                page.close()
+        except Exception as e:
+            _page_extract_error(pdf_path, i, e)
+            continue
+        _keep_page(pages_data, i, text)
+    return pages_data
+
+def _extract_range_pypdf(reader: PdfReader, pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Pure-Python fallback for files PDFium refuses to open"""
+    pages_data = []
+    for i in range(start, stop):
+        try:
+            text = reader.pages[i].extract_text()
+        except Exception as e:
+            _page_extract_error(pdf_path, i, e)
+            continue
+        _keep_page(pages_data, i, text)
+    return pages_data
+
+def _extract_pages(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Worker task (top-level so it pickles); only the requested pages are loaded"""
+    with _pdfium_lock:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+        except pdfium.PdfiumError as e:
+            logger.warning("pdfium_open_error", file=os.path.basename(pdf_path), error=str(e))
+        else:
+            try:
+                return _extract_range_pdfium(pdf, pdf_path, start, stop)
+            finally:
+                pdf.close()
+    
+    return _extract_range_pypdf(PdfReader(pdf_path), pdf_path, start, stop)
+
+def _page_count(pdf_path: str) -> int:
+    """Number of pages; raises if neither PDFium nor pypdf can open the file"""
+    with _pdfium_lock:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+        except pdfium.PdfiumError:
+            pass
+        else:
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    
+    return len(PdfReader(pdf_path).pages)
+
+def _get_max_workers() -> int:
+    return max(1, min(settings.PDF_EXTRACT_WORKERS, os.cpu_count() or 1))
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Process pool shared by every ingest, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: workers import only this module, not the parent's models and threads
+            _executor = ProcessPoolExecutor(
+                max_workers=_get_max_workers(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def _page_ranges(num_pages: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) in page order as page ranges finish; raises if the PDF can't be read"""
+    try:
+        num_pages = _page_count(pdf_path)
+    except Exception as e:
+        logger.error("pdf_read_error", file=pdf_path, error=str(e))
+        raise
+    
+    ranges = _page_ranges(num_pages)
+    if len(ranges) <= 1 or _get_max_workers() == 1:
+        # Not worth the IPC round-trip
+        results = (_extract_pages(pdf_path, start, stop) for start, stop in ranges)
+    else:
+        results = _get_executor().map(
+            _extract_pages,
+            repeat(pdf_path),
+            [start for start, _ in ranges],
+            [stop for _, stop in ranges]
+        )
+    
+    total_pages = 0
+    for pages_data in results:
+        total_pages += len(pages_data)
+        yield from pages_data
+    
+    logger.info("pdf_text_extracted",
+               file=os.path.basename(pdf_path),
+               total_pages=total_pages)
+
+def iter_pdfs(pdf_paths: List[str]) -> Iterator[Tuple[str, List[Tuple[int, str]]]]:
+    """
+    Extract several PDFs as one flat list of page-range tasks
+    
+    Pages of every file are spread over the process pool together, so many
+    small PDFs keep all workers busy too.
+    
+    Yields:
+        (pdf_path, [(page_number, text)]) per file, in input order; PDFs that
+        fail to open or extract are logged and skipped
+    """
+    ranges_by_path = {}
+    for pdf_path in pdf_paths:
+        try:
+            ranges_by_path[pdf_path] = _page_ranges(_page_count(pdf_path))
+        except Exception as e:
+            logger.error("pdf_read_error", file=pdf_path, error=str(e))
+    
+    in_process = _get_max_workers() == 1 or sum(map(len, ranges_by_path.values())) <= 1
+    
+    # Submit everything up front so workers stay busy while earlier files are consumed
+    pending = []
+    for pdf_path, ranges in ranges_by_path.items():
+        if in_process:
+            pending.append((pdf_path, ranges))
+        else:
+            executor = _get_executor()
+            pending.append((pdf_path, [executor.submit(_extract_pages, pdf_path, start, stop) for start, stop in ranges]))
+    
+    for pdf_path, tasks in pending:
+        try:
+            if in_process:
+                pages_data = [page for start, stop in tasks for page in _extract_pages(pdf_path, start, stop)]
+            else:
+                pages_data = [page for future in tasks for page in future.result()]
+        except Exception as e:
+            logger.error("pdf_read_error", file=pdf_path, error=str(e))
+            continue
+        
+        logger.info("pdf_text_extracted",
+                   file=os.path.basename(pdf_path),
+                   total_pages=len(pages_data))
+        yield pdf_path, pages_data
+
+def shutdown_executor():
+    """Stop the worker processes (called on app shutdown)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
@@ -1,22 +1,14 @@
 from services.llm import llm_service
+from cachetools import TTLCache
+import copy
+import orjson
 import structlog
-import json
 
 logger = structlog.get_logger()
 
-class QueryAnalyzer:
-    """Analyze and classify user queries"""
-    
-    async def analyze_query(self, query: str) -> dict:
-        """
-        Analyze query type and characteristics
-        
-        Returns:
-            dict: Query analysis including type, complexity, entities
-        """
-        prompt = f"""Analyze this user query and provide classification.
-
-Query: {query}
+# Static instructions first, query last, so the prompt prefix is identical on every call;
+# literal JSON braces are doubled for format_map
+QUERY_ANALYSIS_PROMPT_TMPL = """Analyze the user query below and provide classification.
 
 Respond ONLY with valid JSON in this exact format:
 {{
@@ -27,9 +19,33 @@ Respond ONLY with valid JSON in this exact format:
     "intent": "brief description of user intent"
 }}
 
+Query: {query}
+
 Classification:"""
+
+class QueryAnalyzer:
+    """Analyze and classify user queries"""
+    
+    def __init__(self):
+        # Classification is deterministic (temperature 0), so repeated queries reuse it
+        self._cache = TTLCache(maxsize=5000, ttl=86400)
+    
+    async def analyze_query(self, query: str) -> dict:
+        """
+        Analyze query type and characteristics
+        
+        Returns:
+            dict: Query analysis including type, complexity, entities
+        """
+        cache_key = " ".join(query.lower().split())
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info("query_analysis_cache_hit", query=query[:50])
+            return copy.deepcopy(cached)
+        
+        prompt = QUERY_ANALYSIS_PROMPT_TMPL.format_map({"query": query})
         
-        response = await llm_service.generate(prompt)
+        response = await llm_service.generate(prompt, semantic_key=query)
         
         try:
             # Clean response
@@ -39,13 +55,14 @@ Classification:"""
             elif "```" in cleaned:
                 cleaned = cleaned.split("```")[1].split("```")[0].strip()
             
-            analysis = json.loads(cleaned)
+            analysis = orjson.loads(cleaned)
             
             logger.info("query_analysis",
                        query=query[:50],
                        type=analysis.get("type"),
                        complexity=analysis.get("complexity"))
             
+            self._cache[cache_key] = copy.deepcopy(analysis)
             return analysis
         except Exception as e:
             logger.warning("query_analysis_parse_error",
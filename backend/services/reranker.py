@@ -1,6 +1,11 @@
 from sentence_transformers import CrossEncoder
+from cachetools import LRUCache
 from config import settings
+import hashlib
+import numpy as np
 import structlog
+import threading
+import torch
 from typing import List, Tuple
 
 logger = structlog.get_logger()
@@ -15,6 +20,19 @@ class RerankerService:
         
         self.model = CrossEncoder(settings.RERANKER_MODEL)
         
+        if self.model._target_device.type == "cuda":
+            # fp16 tensor cores; scores only need to rank, not be bit-exact
+            self.model.model.half()
+        elif settings.RERANKER_INT8:
+            self.model.model = torch.quantization.quantize_dynamic(
+                self.model.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.info("reranker_model_quantized", dtype="qint8")
+        
+        # (query, document digest) -> score; self-correction re-scores the same pairs
+        self._score_cache = LRUCache(maxsize=8192)
+        self._score_cache_lock = threading.Lock()
+        
         logger.info("reranker_service_init",
                    model=settings.RERANKER_MODEL,
                    status="ready")
@@ -39,35 +57,58 @@ class RerankerService:
         if top_k is None:
             top_k = settings.TOP_K_RERANK
         
-        # Create query-document pairs
-        pairs = [[query, doc] for doc in documents]
-        
         # Get scores from cross-encoder
-        scores = self.model.predict(pairs)
+        scores = self._score_pairs(query, documents)
         
-        # Sort by score (descending)
-        ranked = sorted(
-            zip(documents, scores),
-            key=lambda x: x[1],
-            reverse=True
-        )
+        # Filter by threshold, then select the top-k without sorting everything
+        passing = np.flatnonzero(scores > threshold)
+        candidates = passing
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        top = candidates[np.argsort(-scores[candidates], kind="stable")]
         
-        # Filter by threshold
-        ranked = [(doc, score) for doc, score in ranked if score > threshold]
+        ranked = [(documents[i], float(scores[i])) for i in top]
         
         logger.info("rerank_completed",
                    num_docs=len(documents),
                    top_k=top_k,
                    threshold=threshold,
-                   filtered_count=len(ranked),
-                   top_score=float(ranked[0][1]) if ranked else 0)
+                   filtered_count=len(passing),
+                   top_score=ranked[0][1] if ranked else 0)
         
-        return ranked[:top_k]
+        return ranked
     
     def get_scores(self, query: str, documents: List[str]) -> List[float]:
         """Get relevance scores without sorting"""
-        pairs = [[query, doc] for doc in documents]
-        return self.model.predict(pairs).tolist()
+        return self._score_pairs(query, documents).tolist()
+    
+    def _score_pairs(self, query: str, documents: List[str]) -> np.ndarray:
+        """Score query-document pairs, only running the model on uncached pairs"""
+        keys = [(query, hashlib.blake2b(doc.encode(), digest_size=16).digest()) for doc in documents]
+        scores = np.empty(len(documents), dtype=np.float32)
+        missing = []
+        
+        with self._score_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._score_cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    scores[i] = cached
+        
+        if missing:
+            predicted = self.model.predict(
+                [[query, documents[i]] for i in missing],
+                batch_size=settings.RERANK_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            with self._score_cache_lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = score
+                    self._score_cache[keys[i]] = float(score)
+        
+        return scores
 
 # Singleton instance
 reranker_service = RerankerService()
\ No newline at end of file
@@ -0,0 +1,86 @@
+from services.embedding import embedding_service
+from config import settings
+import numpy as np
+import structlog
+import time
+from typing import Optional
+
+logger = structlog.get_logger()
+
+class SemanticCache:
+    """In-memory LLM response cache matched by cosine similarity of query embeddings"""
+    
+    def __init__(self, threshold: float = 0.95, ttl: int = 3600, max_entries: int = 2048):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        # partition -> normalized query vectors, responses and expiry times (row-aligned)
+        self._vectors: dict[str, np.ndarray] = {}
+        self._responses: dict[str, list[str]] = {}
+        self._expires: dict[str, np.ndarray] = {}
+        
+        logger.info("semantic_cache_init",
+                   threshold=threshold,
+                   ttl=ttl,
+                   max_entries=max_entries)
+    
+    def accepts(self, text: str) -> bool:
+        """Text longer than the embedding model's window would be compared on a truncated prefix"""
+        tokens = embedding_service.model.tokenizer(text, add_special_tokens=True, verbose=False)["input_ids"]
+        return len(tokens) <= embedding_service.model.max_seq_length
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Unit-length embedding, so a dot product is the cosine similarity"""
+        vector = np.asarray(await embedding_service.embed_text_async(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, partition: str, vector: np.ndarray) -> Optional[str]:
+        """Best cached response in the partition above the similarity threshold"""
+        vectors = self._vectors.get(partition)
+        if vectors is None:
+            return None
+        
+        similarities = vectors @ vector
+        similarities[self._expires[partition] < time.monotonic()] = -1.0
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        
+        logger.info("semantic_cache_hit", similarity=round(float(similarities[best]), 4))
+        return self._responses[partition][best]
+    
+    def insert(self, partition: str, vector: np.ndarray, response: str):
+        """Store a response, evicting expired entries and then the oldest ones"""
+        now = time.monotonic()
+        vectors = self._vectors.get(partition)
+        if vectors is None:
+            vectors = np.empty((0, vector.shape[0]), dtype=np.float32)
+            responses, expires = [], np.empty(0)
+        else:
+            keep = self._expires[partition] >= now
+            vectors = vectors[keep]
+            responses = [r for r, k in zip(self._responses[partition], keep) if k]
+            expires = self._expires[partition][keep]
+        
+        vectors = np.vstack([vectors, vector[None, :]])[-self.max_entries:]
+        responses = (responses + [response])[-self.max_entries:]
+        expires = np.append(expires, now + self.ttl)[-self.max_entries:]
+        
+        self._vectors[partition] = vectors
+        self._responses[partition] = responses
+        self._expires[partition] = expires
+    
+    def clear(self):
+        """Drop all cached responses"""
+        self._vectors.clear()
+        self._responses.clear()
+        self._expires.clear()
+
+# Singleton instance
+semantic_cache = SemanticCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES
+)
@@ -1,16 +1,71 @@
+import asyncio
 import chromadb
 from chromadb.config import Settings as ChromaSettings
-from pypdf import PdfReader
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from services.embedding import embedding_service
-from services.bm25_search import bm25_service
+from services.embedding_cache import embedding_cache
+from services.pdf_extraction import iter_pdf_pages, iter_pdfs
+from services.bm25_search import BM25SearchService
 from config import settings
-from rank_bm25 import BM25Okapi
 import structlog
 import os
-from typing import List, Dict, Tuple
+import re
+import threading
+from typing import List, Dict, Iterable, Iterator, Tuple
+import numpy as np
 
 logger = structlog.get_logger()
 
+_WORD_RE = re.compile(r"\S+")
+
+def _with_citations(documents: List[str], metadatas: List[Dict]) -> List[str]:
+    """Prefix retrieved chunks with their "[Source: file, Page: n]" header (the LLM and UI cite from it)"""
+    cited = []
+    for doc, metadata in zip(documents, metadatas):
+        # Chunks indexed before the header moved to metadata still carry it in the text
+        if metadata and "source" in metadata and not doc.startswith("[Source:"):
+            doc = f"[Source: {metadata['source']}, Page: {metadata.get('page', '?')}]\n\n{doc}"
+        cited.append(doc)
+    return cited
+
+def _object_array(values: List) -> np.ndarray:
+    """1-D object array over values (elements are never unpacked, even dicts or lists)"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+def _appended(buffer: np.ndarray, size: int, values: List) -> np.ndarray:
+    """
+    Object buffer with values written after its first size slots
+    
+    Grows by doubling, so appends are amortized O(len(values)). Slots before
+    size are never written, which keeps views of them valid for readers.
+    """
+    needed = size + len(values)
+    if needed > len(buffer):
+        grown = np.empty(max(needed, 2 * len(buffer)), dtype=object)
+        grown[:size] = buffer[:size]
+        buffer = grown
+    buffer[size:needed] = _object_array(values)
+    return buffer
+
+# Rows per collection.get() when reading the whole store back
+COLLECTION_PAGE_SIZE = 10_000
+
+# Saved BM25 index; inside the Chroma directory so it lives on the same volume
+BM25_INDEX_DIR = os.path.join(settings.CHROMA_DB_PATH, "bm25")
+
+# Bulk ingest: Chroma adds allowed to run behind extraction and embedding of the next batch
+MAX_PENDING_ADDS = 2
+
+# Saves of the BM25 index, one at a time and off the request path
+_SAVE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25-save")
+
+# BM25 half of hybrid_search; one slot per concurrent retrieval (the caller's thread does the other half)
+_QUERY_POOL = ThreadPoolExecutor(max_workers=settings.RETRIEVAL_CONCURRENCY, thread_name_prefix="bm25")
+
 class VectorStore:
     """Vector database with hybrid search and BM25 support"""
     
@@ -24,22 +79,26 @@ class VectorStore:
             metadata={"hnsw:space": "cosine"}
         )
         
-        # BM25 index
-        self.bm25 = None
-        self.bm25_docs = []
-        self.bm25_ids = []
-        self.bm25_metadatas = []
+        # BM25 index, appended to as documents are indexed (rebuilt from Chroma after deletes).
+        # _bm25_lock guards what searches read and is only held for swaps;
+        # _bm25_write_lock serializes appends and rebuilds, which do their work outside it
+        self._bm25_lock = threading.Lock()
+        self._bm25_write_lock = threading.Lock()
+        self._bm25_save_lock = threading.Lock()
+        self._bm25_save_queued = False
+        self._install_bm25(BM25SearchService(), [], [], [])
         
-        # Initialize BM25 from existing documents
-        self._rebuild_bm25_index()
+        # Initialize BM25 from the saved index, or from existing documents when it is missing or stale
+        if not self._load_bm25_index():
+            self._rebuild_bm25_index()
         
         logger.info("vector_store_init",
                    path=settings.CHROMA_DB_PATH,
                    collection="documents",
                    total_docs=self.collection.count())
     
-    def load_pdfs(self, directory: str = "/app/data/documents"):
-        """Load and index all PDFs from directory"""
+    async def load_pdfs(self, directory: str = "/app/data/documents"):
+        """Load and index all PDFs from directory (blocking work runs in worker threads)"""
         if not os.path.exists(directory):
             logger.warning("pdf_directory_not_found", path=directory)
             os.makedirs(directory, exist_ok=True)
@@ -53,12 +112,15 @@ class VectorStore:
         
         logger.info("loading_pdfs", count=len(pdf_files))
         
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(directory, pdf_file)
-            try:
-                self.index_document(pdf_path)
-            except Exception as e:
-                logger.error("pdf_load_error", file=pdf_file, error=str(e))
+        # Pages of all files are extracted in parallel; chunks from every file
+        # then share the same fixed-size embedding batches
+        pdf_paths = [os.path.join(directory, pdf_file) for pdf_file in pdf_files]
+        chunks = (
+            chunk
+            for pdf_path, pages_data in iter_pdfs(pdf_paths)
+            for chunk in self._iter_chunks(pages_data, os.path.basename(pdf_path))
+        )
+        await self._add_chunks_async(chunks)
         
         logger.info("pdf_loading_complete", total_chunks=self.collection.count())
     
@@ -68,163 +130,374 @@ class VectorStore:
         logger.info("indexing_document", file=filename)
         
         try:
-            pages_data = self._extract_text_from_pdf(pdf_path)
+            # Pages stream from extraction into chunking and embedding batches
+            num_chunks = self._add_chunks(self._iter_chunks(iter_pdf_pages(pdf_path), filename))
             
-            if not pages_data:
+            if not num_chunks:
                 logger.warning("document_too_short", file=filename)
                 raise ValueError("Document content too short or empty")
             
-            chunks_data = self._create_chunks(pages_data, filename)
-            
-            if not chunks_data:
-                logger.warning("no_chunks_created", file=filename)
-                raise ValueError("No chunks created from document")
-            
-            ids = [chunk["id"] for chunk in chunks_data]
-            documents = [chunk["text"] for chunk in chunks_data]
-            metadatas = [chunk["metadata"] for chunk in chunks_data]
-            
-            # Embed chunks
-            embeddings = embedding_service.embed_batch(documents)
-            
-            # Add to ChromaDB
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas
-            )
-            
             logger.info("document_indexed",
                        file=filename,
-                       chunks=len(chunks_data),
+                       chunks=num_chunks,
                        total_docs=self.collection.count())
             
             return {
                 "path": pdf_path,
                 "filename": filename,
-                "chunks": len(chunks_data),
+                "chunks": num_chunks,
                 "total_chunks": self.collection.count()
             }
             
         except Exception as e:
             logger.error("index_document_error", file=filename, error=str(e))
             raise
-    def _extract_text_from_pdf(self, pdf_path: str) -> List[Tuple[int, str]]:
-        """Extract text preserving page numbers"""
+    
+    def _add_chunks(self, chunks: Iterable[Dict]) -> int:
+        """
+        Embed and store a stream of chunks, EMBED_BATCH at a time
+        
+        Only one batch of embeddings is alive at once. Chunk texts are kept
+        anyway by the BM25 index, which gets them in one append at the end
+        (or a rebuild from Chroma if a later batch fails).
+        
+        Returns:
+            Number of chunks stored
+        """
+        chunk_iter = iter(chunks)
+        ids, documents, metadatas = [], [], []
+        try:
+            while batch := self._next_batch(chunk_iter):
+                batch_ids, batch_documents, batch_metadatas = batch
+                self._collection_add(batch_ids, self._embed_documents(batch_documents), batch_documents, batch_metadatas)
+                ids.extend(batch_ids)
+                documents.extend(batch_documents)
+                metadatas.extend(batch_metadatas)
+        except Exception:
+            if ids:
+                # Earlier batches are already in Chroma; resync BM25 so hybrid search sees them
+                self._rebuild_bm25_index()
+            raise
+        
+        if ids:
+            self._bm25_append(ids, documents, metadatas)
+        return len(ids)
+    
+    async def _add_chunks_async(self, chunks: Iterable[Dict]) -> int:
+        """_add_chunks for bulk ingest: a batch's Chroma add runs while the next batch is extracted and embedded"""
+        chunk_iter = iter(chunks)
+        ids, documents, metadatas = [], [], []
+        pending_adds = deque()
         try:
-            reader = PdfReader(pdf_path)
-            pages_data = []  # List of (page_number, text) tuples
-            
-            for i, page in enumerate(reader.pages):
-                try:
-                    text = page.extract_text()
-                    if text and len(text.strip()) > 10:
-                        pages_data.append((i + 1, text))
-                except Exception as e:
-                    logger.warning("page_extract_error", 
-                                 file=os.path.basename(pdf_path), 
-                                 page=i+1, 
-                                 error=str(e))
-                    continue
+            while batch := await asyncio.to_thread(self._next_batch, chunk_iter):
+                batch_ids, batch_documents, batch_metadatas = batch
+                embeddings = await asyncio.to_thread(self._embed_documents, batch_documents)
+                
+                # Backpressure: never more than MAX_PENDING_ADDS batches waiting on Chroma
+                if len(pending_adds) >= MAX_PENDING_ADDS:
+                    await pending_adds.popleft()
+                pending_adds.append(asyncio.create_task(asyncio.to_thread(
+                    self._collection_add, batch_ids, embeddings, batch_documents, batch_metadatas
+                )))
+                
+                ids.extend(batch_ids)
+                documents.extend(batch_documents)
+                metadatas.extend(batch_metadatas)
             
-            logger.info("pdf_text_extracted", 
-                       file=os.path.basename(pdf_path), 
-                       total_pages=len(pages_data))
+            while pending_adds:
+                await pending_adds.popleft()
+        except Exception:
+            # Threads behind pending adds can't be interrupted; let them land before resyncing
+            await asyncio.gather(*pending_adds, return_exceptions=True)
+            pending_adds.clear()
+            if ids:
+                # Earlier batches are already in Chroma; resync BM25 so hybrid search sees them
+                await asyncio.to_thread(self._rebuild_bm25_index)
+            raise
+        finally:
+            for task in pending_adds:
+                task.cancel()
+        
+        if ids:
+            self._bm25_append(ids, documents, metadatas)
+        return len(ids)
+    
+    def _next_batch(self, chunk_iter: Iterator[Dict]) -> Tuple[List[str], List[str], List[Dict]] | None:
+        """Pull up to EMBED_BATCH chunks as (ids, documents, metadatas), None once exhausted"""
+        batch = list(islice(chunk_iter, settings.EMBED_BATCH))
+        if not batch:
+            return None
+        return (
+            [chunk["id"] for chunk in batch],
+            [chunk["text"] for chunk in batch],
+            [chunk["metadata"] for chunk in batch]
+        )
+    
+    def _collection_add(self, ids: List[str], embeddings: np.ndarray, documents: List[str], metadatas: List[Dict]):
+        # Add to ChromaDB (its validator only accepts plain lists)
+        self.collection.add(
+            ids=ids,
+            embeddings=embeddings.tolist(),
+            documents=documents,
+            metadatas=metadatas
+        )
+    
+    def _bm25_append(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        """Add new chunks to the BM25 index, tokenizing only them"""
+        with self._bm25_write_lock:
+            # Chunk ids are deterministic and Chroma skips ids it already has (re-initialize,
+            # same-name upload), so BM25 must skip them too or it would hold duplicate rows
+            seen = set()
+            keep = []
+            for i, chunk_id in enumerate(ids):
+                if chunk_id not in self._bm25_id_set and chunk_id not in seen:
+                    seen.add(chunk_id)
+                    keep.append(i)
+            if len(keep) < len(ids):
+                logger.info("bm25_skipped_existing_ids", num_skipped=len(ids) - len(keep))
+                ids = [ids[i] for i in keep]
+                documents = [documents[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep]
+            if not ids:
+                return
             
-            return pages_data 
+            # Tokenizing and growing the matrix and arrays happen before searches are blocked
+            prepared = self.bm25.prepare_documents(documents)
+            size = len(self.bm25_ids)
+            docs_buf = _appended(self._bm25_docs_buf, size, documents)
+            ids_buf = _appended(self._bm25_ids_buf, size, ids)
+            metadatas_buf = _appended(self._bm25_metadatas_buf, size, metadatas)
             
-        except Exception as e:
-            logger.error("pdf_read_error", file=pdf_path, error=str(e))
-            raise
+            with self._bm25_lock:
+                self.bm25.apply_documents(prepared)
+                self.bm25_docs.extend(documents)
+                self.bm25_ids.extend(ids)
+                self.bm25_metadatas.extend(metadatas)
+                self._set_bm25_arrays(docs_buf, ids_buf, metadatas_buf, size + len(ids))
+            self._bm25_id_set.update(ids)
+        
+        self._schedule_bm25_save()
+        
+        logger.info("bm25_index_appended",
+                   num_added=len(documents),
+                   num_docs=len(self.bm25_docs))
+    
+    def _embed_documents(self, documents: List[str]) -> np.ndarray:
+        """Embed chunk texts once per distinct text, reusing vectors cached by earlier ingests"""
+        keys = [embedding_cache.key(doc) for doc in documents]
+        cached = embedding_cache.get_many(keys)
+        
+        embeddings = np.empty((len(documents), embedding_service.get_embedding_dimension()), dtype=np.float32)
+        # Uncached key -> every row that needs it (repeated boilerplate is embedded once)
+        missing: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(keys):
+            vector = cached.get(key)
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                embeddings[i] = vector
+        
+        if missing:
+            missing_keys = list(missing)
+            computed = embedding_service.embed_batch([documents[missing[key][0]] for key in missing_keys])
+            for key, vector in zip(missing_keys, computed):
+                embeddings[missing[key]] = vector
+            embedding_cache.put_many(missing_keys, computed)
+        
+        logger.info("chunks_embedded",
+                   total=len(documents),
+                   cached=len(documents) - sum(map(len, missing.values())),
+                   embedded=len(missing))
+        
+        return embeddings
     
-    def _create_chunks(self, pages_data: List[Tuple[int, str]], filename: str) -> List[Dict]:
-        """Create chunks with page numbers in metadata"""
-        chunks_data = []
+    def _iter_chunks(self, pages: Iterable[Tuple[int, str]], filename: str) -> Iterator[Dict]:
+        """Yield chunks with page numbers in metadata, one page at a time"""
+        num_chunks = 0
         
         chunk_size = settings.CHUNK_SIZE
         chunk_overlap = settings.CHUNK_OVERLAP
         
-        for page_num, page_text in pages_data:
-            words = page_text.split()
+        for page_num, page_text in pages:
+            # (start, end) offset of every word; each chunk is then one slice of the page text, no re-join
+            spans = np.array([match.span() for match in _WORD_RE.finditer(page_text)], dtype=np.int64).reshape(-1, 2)
             
-            if not words:
+            if not len(spans):
                 continue
             
-            for i in range(0, len(words), chunk_size - chunk_overlap):
-                chunk_words = words[i:i + chunk_size]
-                
-
-                chunk_text = ' '.join(chunk_words)
-                
-                chunk_id = f"{filename}_p{page_num}_{len(chunks_data)}"
+            # Character bounds of every window at once: first word's start, last word's end
+            first_words = np.arange(0, len(spans), chunk_size - chunk_overlap)
+            last_words = np.minimum(first_words + chunk_size, len(spans)) - 1
+            
+            for start, end in zip(spans[first_words, 0].tolist(), spans[last_words, 1].tolist()):
+                chunk_text = page_text[start:end]
                 
-                cited_chunk = f"[Source: {filename}, Page: {page_num}]\n\n{chunk_text}"
+                chunk_id = f"{filename}_p{page_num}_{num_chunks}"
                 
-                chunks_data.append({
+                # Stored and embedded without the citation header; it is rendered from metadata at retrieval
+                yield {
                     "id": chunk_id,
-                    "text": cited_chunk, 
+                    "text": chunk_text, 
                     "metadata": {
                         "source": filename,
                         "page": page_num,   
-                        "chunk_index": len(chunks_data)
+                        "chunk_index": num_chunks
                     }
-                })
+                }
+                num_chunks += 1
         
+        if not num_chunks:
+            logger.warning("no_chunks_created", file=filename)
         logger.info("chunks_created", 
                    file=filename, 
-                   chunks=len(chunks_data))
-        
-        return chunks_data
+                   chunks=num_chunks)
     def _rebuild_bm25_index(self):
         """Rebuild BM25 index from ALL documents in ChromaDB"""
         logger.info("rebuilding_bm25_index")
         
+        # Appends wait for the rebuild, so none lands in the index being replaced
+        with self._bm25_write_lock:
+            try:
+                # Page through ChromaDB; documents and metadata only, never the vectors
+                ids, documents, metadatas = [], [], []
+                for page in self._iter_collection(include=["documents", "metadatas"]):
+                    ids.extend(page["ids"])
+                    documents.extend(page["documents"])
+                    metadatas.extend(page.get("metadatas") or [{} for _ in page["ids"]])
+                
+                if not documents:
+                    logger.warning("no_documents_for_bm25_rebuild")
+                    self._install_bm25(BM25SearchService(), [], [], [])
+                    self._schedule_bm25_save()
+                    return
+                
+                # Sparse term-frequency matrix, scored with vectorized BM25
+                bm25 = BM25SearchService()
+                bm25.index_documents(documents)
+                self._install_bm25(bm25, ids, documents, metadatas)
+                self._schedule_bm25_save()
+                
+                logger.info("bm25_index_rebuilt",
+                           num_docs=len(documents),
+                           total_tokens=int(bm25.doc_lens.sum()))
+                
+            except Exception as e:
+                logger.error("bm25_rebuild_error", error=str(e))
+                # Don't crash, just disable BM25
+                self._install_bm25(BM25SearchService(), [], [], [])
+    
+    def _load_bm25_index(self) -> bool:
+        """Restore the saved BM25 index if it still matches the collection; False means rebuild"""
         try:
-            # Get ALL documents from ChromaDB
-            all_results = self.collection.get()
-            
-            if not all_results or not all_results.get("documents"):
-                logger.warning("no_documents_for_bm25_rebuild")
-                self.bm25 = None
-                self.bm25_docs = []
-                self.bm25_ids = []
-                self.bm25_metadatas = []
-                return
-            
-            documents = all_results["documents"]
-            
-            # Tokenize for BM25
-            tokenized_docs = [doc.lower().split() for doc in documents]
-            
-            # Create new BM25 object
-            self.bm25 = BM25Okapi(tokenized_docs)
+            loaded = BM25SearchService.load(BM25_INDEX_DIR)
+        except Exception as e:
+            logger.warning("bm25_load_error", error=str(e))
+            return False
+        if loaded is None:
+            return False
+        
+        bm25, extra = loaded
+        ids = extra.get("ids") or []
+        num_rows = bm25.tf_csr.shape[0] if bm25.tf_csr is not None else 0
+        count = self.collection.count()
+        if len(ids) != count or num_rows != count:
+            logger.info("bm25_saved_index_stale",
+                       saved_docs=len(ids),
+                       collection_docs=count)
+            return False
+        
+        # Texts and metadata come from Chroma by the saved ids; with equal counts,
+        # every saved id being found means the id sets match
+        documents, metadatas = [], []
+        for start in range(0, len(ids), COLLECTION_PAGE_SIZE):
+            batch = ids[start:start + COLLECTION_PAGE_SIZE]
+            page = self.collection.get(ids=batch, include=["documents", "metadatas"])
+            rows = dict(zip(page["ids"], zip(page["documents"], page.get("metadatas") or [{}] * len(page["ids"]))))
+            if len(rows) != len(batch):
+                logger.info("bm25_saved_index_stale",
+                           missing_ids=len(batch) - len(rows),
+                           collection_docs=count)
+                return False
+            for chunk_id in batch:
+                document, metadata = rows[chunk_id]
+                documents.append(document)
+                metadatas.append(metadata)
+        
+        bm25.corpus = documents
+        self._install_bm25(bm25, ids, list(documents), metadatas)
+        return True
+    
+    def _install_bm25(self, bm25: BM25SearchService, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        """Make bm25 (built over these rows) the live index; the O(N) arrays are built before the swap"""
+        docs_buf = _object_array(documents)
+        ids_buf = _object_array(ids)
+        metadatas_buf = _object_array(metadatas)
+        with self._bm25_lock:
+            self.bm25 = bm25
             self.bm25_docs = documents
-            self.bm25_ids = all_results["ids"]
-            self.bm25_metadatas = all_results.get("metadatas", [])
-            
-            logger.info("bm25_index_rebuilt",
-                       num_docs=len(documents),
-                       total_tokens=sum(len(tokens) for tokens in tokenized_docs))
-            
+            self.bm25_ids = ids
+            self.bm25_metadatas = metadatas
+            self._set_bm25_arrays(docs_buf, ids_buf, metadatas_buf, len(ids))
+        # Only read by writers, under _bm25_write_lock
+        self._bm25_id_set = set(ids)
+    
+    def _set_bm25_arrays(self, docs_buf: np.ndarray, ids_buf: np.ndarray, metadatas_buf: np.ndarray, size: int):
+        """Object-array views of the BM25 rows, so search gathers top-k with one fancy index (caller holds _bm25_lock)"""
+        self._bm25_docs_buf = docs_buf
+        self._bm25_ids_buf = ids_buf
+        self._bm25_metadatas_buf = metadatas_buf
+        self._bm25_docs_arr = docs_buf[:size]
+        self._bm25_ids_arr = ids_buf[:size]
+        self._bm25_metadatas_arr = metadatas_buf[:size]
+    
+    def _schedule_bm25_save(self):
+        """Save the BM25 index in the background; requests made while one is still queued share it"""
+        with self._bm25_save_lock:
+            if self._bm25_save_queued:
+                return
+            self._bm25_save_queued = True
+        _SAVE_POOL.submit(self._save_bm25_index)
+    
+    def _save_bm25_index(self):
+        """Persist what scoring needs plus the row ids; texts and metadata stay in Chroma only"""
+        with self._bm25_save_lock:
+            self._bm25_save_queued = False
+        
+        # Writers are the only mutators, so copying under their lock never blocks searches
+        with self._bm25_write_lock:
+            snapshot = self.bm25.snapshot()
+            ids = list(self.bm25_ids)
+        
+        try:
+            BM25SearchService.save_snapshot(BM25_INDEX_DIR, snapshot, ids=ids)
         except Exception as e:
-            logger.error("bm25_rebuild_error", error=str(e))
-            # Don't crash, just disable BM25
-            self.bm25 = None
-            self.bm25_docs = []
+            # Only costs a rebuild on the next start
+            logger.warning("bm25_save_error", error=str(e))
     
-    def semantic_search(self, query_text: str, top_k: int = None) -> dict:
+    def _iter_collection(self, include: List[str]) -> Iterator[dict]:
+        """collection.get() in pages of COLLECTION_PAGE_SIZE, so no single call materializes the whole store"""
+        offset = 0
+        while True:
+            page = self.collection.get(include=include, limit=COLLECTION_PAGE_SIZE, offset=offset)
+            if not page or not page["ids"]:
+                return
+            yield page
+            offset += len(page["ids"])
+    
+    def semantic_search(self, query_text: str, top_k: int = None, query_embedding: np.ndarray = None) -> dict:
         """Semantic vector search using embeddings"""
         if top_k is None:
             top_k = settings.TOP_K_RETRIEVAL
         
-        query_embedding = embedding_service.embed_text(query_text)
+        if query_embedding is None:
+            query_embedding = embedding_service.embed_query(query_text)
         
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=[query_embedding.tolist()],
             n_results=top_k
         )
         
+        ids = results['ids'][0] if results['ids'] else []
         documents = results['documents'][0] if results['documents'] else []
         metadatas = results['metadatas'][0] if results['metadatas'] else []
         distances = results['distances'][0] if results['distances'] else []
@@ -234,42 +507,54 @@ class VectorStore:
                    results=len(documents))
         
         return {
-            "documents": documents,
+            "ids": ids,
+            "documents": _with_citations(documents, metadatas),
             "metadatas": metadatas,
             "distances": [max(0.0, min(1.0, 1.0 - dist)) for dist in distances]
         }
     
-    def bm25_search(self, query_text: str, top_k: int = None) -> List[Tuple[str, float]]:
+    def bm25_search(self, query_text: str, top_k: int = None) -> dict:
         """Keyword search using BM25"""
         if top_k is None:
             top_k = settings.TOP_K_RETRIEVAL
         
-        if not self.bm25 or not self.bm25_docs:
+        empty = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        if not self.bm25_docs:
             logger.warning("bm25_not_available")
-            return []
+            return empty
         
-        # Tokenize query
-        tokenized_query = query_text.lower().split()
-        
-        # Get BM25 scores
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Get top-k results
-        top_indices = sorted(
-            range(len(scores)),
-            key=lambda i: scores[i],
-            reverse=True
-        )[:top_k]
-        
-        results = [(self.bm25_docs[i], float(scores[i])) for i in top_indices if scores[i] > 0]
+        # Scoring is milliseconds; the lock only keeps an in-flight append from being half-visible
+        with self._bm25_lock:
+            # Get BM25 scores
+            scores = self.bm25.score(query_text)
+            
+            # Top-k: O(N) partition, then sort only the k survivors (ties keep index order)
+            k = min(top_k, scores.size)
+            top_indices = np.sort(np.argpartition(-scores, k - 1)[:k]) if k > 0 else np.empty(0, dtype=np.intp)
+            top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")]
+            top_scores = scores[top_indices]
+            keep = top_scores > 0
+            top_indices, top_scores = top_indices[keep], top_scores[keep]
+            
+            metadatas = self._bm25_metadatas_arr[top_indices].tolist()
+            results = {
+                "ids": self._bm25_ids_arr[top_indices].tolist(),
+                "documents": _with_citations(self._bm25_docs_arr[top_indices].tolist(), metadatas),
+                "metadatas": metadatas,
+                "scores": top_scores.tolist()
+            }
         
         logger.info("bm25_search",
                    query=query_text[:50],
-                   results=len(results))
+                   results=len(results["ids"]))
         
         return results
     
-    def hybrid_search(self, query_text: str, top_k: int = None, alpha: float = 0.5) -> dict:
+    def hybrid_search(self,
+                      query_text: str,
+                      top_k: int = None,
+                      alpha: float = 0.5,
+                      query_embedding: np.ndarray = None) -> dict:
         """
         Hybrid search combining semantic (vector) and keyword (BM25) search
         
@@ -277,18 +562,21 @@ class VectorStore:
             query_text: Search query
             top_k: Number of results to return
             alpha: Weight for semantic search (0-1). 1-alpha for BM25
+            query_embedding: Precomputed embedding of query_text, if available
         
         Returns:
-            dict with documents, metadatas, and fused scores
+            dict with ids, documents, metadatas, and fused scores
         """
         if top_k is None:
             top_k = settings.TOP_K_RETRIEVAL
         
+        # BM25 search on the query pool while this thread runs the semantic search
+        bm25_future = _QUERY_POOL.submit(self.bm25_search, query_text, top_k * 2)
+        
         # Semantic search
-        semantic_results = self.semantic_search(query_text, top_k * 2)
+        semantic_results = self.semantic_search(query_text, top_k * 2, query_embedding=query_embedding)
         
-        # BM25 search
-        bm25_results = self.bm25_search(query_text, top_k * 2)
+        bm25_results = bm25_future.result()
         
         # Reciprocal Rank Fusion
         fused = self._reciprocal_rank_fusion(
@@ -301,14 +589,14 @@ class VectorStore:
         logger.info("hybrid_search",
                    query=query_text[:50],
                    semantic_count=len(semantic_results['documents']),
-                   bm25_count=len(bm25_results),
+                   bm25_count=len(bm25_results['documents']),
                    fused_count=len(fused['documents']))
         
         return fused
     
     def _reciprocal_rank_fusion(self, 
                                 semantic_results: dict, 
-                                bm25_results: List[Tuple[str, float]], 
+                                bm25_results: dict, 
                                 alpha: float = 0.5,
                                 top_k: int = None) -> dict:
         """Fuse semantic and BM25 results using Reciprocal Rank Fusion"""
@@ -316,43 +604,44 @@ class VectorStore:
             top_k = settings.TOP_K_RETRIEVAL
         
         k = 60  # RRF constant
-        doc_scores = {}
-        
-        # Score semantic results
-        for rank, doc in enumerate(semantic_results['documents']):
-            score = alpha / (k + rank + 1)
-            if doc not in doc_scores:
-                idx = rank
-                doc_scores[doc] = {
-                    'score': 0,
-                    'metadata': semantic_results['metadatas'][idx] if idx < len(semantic_results['metadatas']) else {}
-                }
-            doc_scores[doc]['score'] += score
-        
-        # Score BM25 results
-        for rank, (doc, bm25_score) in enumerate(bm25_results):
-            score = (1 - alpha) / (k + rank + 1)
-            if doc not in doc_scores:
-                doc_scores[doc] = {'score': 0, 'metadata': {}}
-            doc_scores[doc]['score'] += score
-        
-        # Sort by fused score
-        sorted_docs = sorted(doc_scores.items(), key=lambda x: x[1]['score'], reverse=True)
         
-        # Return top-k
-        final_top_k = min(top_k, len(sorted_docs))
+        # Both ranked lists laid end to end; chunks are grouped by id, never by text
+        ids, documents, metadatas, ranks, weights = [], [], [], [], []
+        for results, weight in ((semantic_results, alpha), (bm25_results, 1 - alpha)):
+            count = min(len(results['ids']), len(results['documents']))
+            result_metadatas = results.get('metadatas') or []
+            ids.extend(results['ids'][:count])
+            documents.extend(results['documents'][:count])
+            metadatas.extend(result_metadatas[rank] if rank < len(result_metadatas) else {} for rank in range(count))
+            ranks.append(np.arange(count))
+            weights.append(np.full(count, weight))
+        
+        if not ids:
+            return {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        
+        contrib = np.concatenate(weights) / (k + np.concatenate(ranks) + 1)
+        _, first, inverse = np.unique(np.asarray(ids), return_index=True, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib)
+        
+        # Sort by fused score; ties keep first-seen order
+        by_first_seen = np.argsort(first)
+        order = by_first_seen[np.argsort(-scores[by_first_seen], kind="stable")][:top_k]
+        rows = first[order]
         
         return {
-            "documents": [doc for doc, _ in sorted_docs[:final_top_k]],
-            "metadatas": [data['metadata'] for _, data in sorted_docs[:final_top_k]],
-            "scores": [data['score'] for _, data in sorted_docs[:final_top_k]]
+            "ids": [ids[i] for i in rows],
+            "documents": [documents[i] for i in rows],
+            "metadatas": [metadatas[i] for i in rows],
+            "scores": scores[order].tolist()
         }
     
     def get_all_documents(self) -> List[str]:
         """Get all indexed document texts"""
         try:
-            results = self.collection.get()
-            return results['documents'] if results and results.get('documents') else []
+            documents = []
+            for page in self._iter_collection(include=["documents"]):
+                documents.extend(page["documents"])
+            return documents
         except Exception as e:
             logger.error("get_all_documents_error", error=str(e))
             return []
@@ -367,7 +656,7 @@ class VectorStore:
                 "total_chunks": total_chunks,
                 "bm25_indexed": bm25_docs,
                 "collection_name": self.collection.name,
-                "bm25_available": self.bm25 is not None
+                "bm25_available": bm25_docs > 0
             }
         except Exception as e:
             logger.error("get_stats_error", error=str(e))